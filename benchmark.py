@@ -0,0 +1,328 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''Benchmarks for the ORTC client protocol and I/O paths.
+
+The protocol benchmarks run in process. The subscribe and loopback
+benchmarks run clients against a local ortc_server.OrtcServer, so no network
+access is needed. Results can be written as JSON to compare releases.
+
+Usage:
+
+>>> python benchmark.py
+>>> python benchmark.py --quick --json results.json
+>>> python benchmark.py --only parse,loopback
+'''
+
+import argparse
+import json
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+
+from ortc_extensibility import *
+
+
+def _legacy_parse(message):
+    # The regex cascade used by OrtcClient._parse_message before FrameDecoder
+    result = None
+    res = re.search(r'^a?\["\{\\"ch\\":\\"(.*)\\",\\"m\\":\\"([\s\S]*?)\\"\}"\]$', message)
+    if not res == None:
+        channel, raw_message = res.groups()
+        res = re.search(r'^(.[^_]*)_(.[^-]*)-(.[^_]*)_([\s\S]*?)$', raw_message)
+        if not res == None:
+            ret = res.groups()
+            result = channel, ret[0], int(ret[1]), int(ret[2]), Private._remove_slashes(ret[3])
+        else:
+            result = channel, Private._remove_slashes(raw_message)
+    res = re.search(r'^a\["\{\\"op\\":\\"([^"]+)\\",\\"(.*)\}"\]$', message)
+    if not res == None:
+        operation, params = res.groups()
+        result = operation, re.search(r'^ch\\":\\"(.*)\\"$', params)
+    return result
+
+
+def _channel_frame(channel, message):
+    return 'a' + json.dumps([json.dumps({'ch': channel, 'm': message}, separators=(',', ':'))])
+
+
+def _sample_frames():
+    payload = json.dumps({'price': 12.5, 'symbol': 'ACME', 'note': 'line\nbreak "quoted"'})
+    return [
+        _channel_frame('blue', 'AbCdEfGh_1-1_' + payload),
+        _channel_frame('blue', 'AbCdEfGh_2-5_' + payload * 20),
+        'a' + json.dumps([json.dumps({'op': 'ortc-subscribed', 'ch': 'blue'}, separators=(',', ':'))]),
+    ]
+
+
+def bench_parse(number=20000):
+    import ortc
+    frames = _sample_frames()
+    decoder = FrameDecoder()
+    client = ortc.OrtcClient()
+    client._channels['blue'] = Channel('blue', True, lambda sender, channel, message: None)
+    def legacy():
+        for f in frames:
+            _legacy_parse(f)
+    def decoded():
+        for f in frames:
+            decoder.decode(f)
+    def parsed():
+        # the whole OrtcClient._parse_message path, inline dispatch included
+        for f in frames[:2]:
+            client._parse_message(f)
+    results = {}
+    for name, fn in (('regex', legacy), ('decoder', decoded), ('client', parsed)):
+        elapsed = min(timeit.repeat(fn, number=number, repeat=3))
+        results[name] = number * (2 if fn is parsed else len(frames)) / elapsed
+    return results
+
+
+def bench_reassembly(parts=(2, 10, 100), number=2000):
+    results = {}
+    payload = 'x' * 800
+    for total in parts:
+        buffer = MessageBuffer(1000, 16*1024*1024, 60)
+        order = list(range(1, total + 1))
+        random.Random(total).shuffle(order)
+        counter = [0]
+        def reassemble():
+            counter[0] += 1
+            message_id = 'M%07d' % counter[0]
+            for part in order:
+                message = buffer.add_part('blue', message_id, part, total, payload)
+            assert len(message) == total * 800
+        elapsed = min(timeit.repeat(reassemble, number=number, repeat=3))
+        results[total] = {'messages': number / elapsed, 'parts': number * total / elapsed}
+    return results
+
+
+
+def _legacy_send_frames(app_key, auth_token, channel, phash, message_id, message):
+    # The per-part concatenation and json.dumps used by OrtcClient.send before FrameEncoder
+    parts = [message[i:i+800] for i in range(0, len(message), 800)]
+    return [json.dumps('send;'+app_key+';'+auth_token+';'+channel+';'+phash+';'+message_id+'_'+str(i+1)+'-'+str(len(parts))+'_'+p) for i, p in enumerate(parts)]
+
+
+def bench_send(sizes=(100, 10000, 100000), number=200):
+    encoder = FrameEncoder('appkey', 'token', 800)
+    results = {}
+    for size in sizes:
+        message = ('{"k":"v\n"}' * (size // 10 + 1))[:size]
+        assert encoder.send_frames('blue', '', 'AbCdEfGh', message) == _legacy_send_frames('appkey', 'token', 'blue', '', 'AbCdEfGh', message)
+        legacy = min(timeit.repeat(lambda: _legacy_send_frames('appkey', 'token', 'blue', '', 'AbCdEfGh', message), number=number, repeat=3))
+        encoded = min(timeit.repeat(lambda: encoder.send_frames('blue', '', 'AbCdEfGh', message), number=number, repeat=3))
+        results[size] = {'legacy': number / legacy, 'encoder': number / encoded}
+    return results
+
+def bench_compression(sizes=(1000, 20000, 200000), number=20):
+    encoder = FrameEncoder('appkey', 'token', 800)
+    compression = PayloadCodec(True, 0)
+    results = {}
+    for size in sizes:
+        rows = []
+        rng = random.Random(size)
+        while sum(map(len, rows)) < size:
+            rows.append(json.dumps({'symbol': 'S%04d' % rng.randrange(10000), 'price': round(rng.uniform(1, 500), 2), 'volume': rng.randrange(100000)}))
+        message = ('[' + ','.join(rows) + ']')[:size]
+        compressed = compression.compress(message) or message
+        assert compressed == message or compression.decompress(compressed) == message
+        plain_frames = encoder.send_frames('blue', '', 'AbCdEfGh', message)
+        compressed_frames = encoder.send_frames('blue', '', '~zAbCdEfGh', compressed)
+        plain = min(timeit.repeat(lambda: encoder.send_frames('blue', '', 'AbCdEfGh', message), number=number, repeat=3))
+        packed = min(timeit.repeat(lambda: encoder.send_frames('blue', '', '~zAbCdEfGh', compression.compress(message) or message), number=number, repeat=3))
+        results[size] = {'plain_parts': len(plain_frames), 'compressed_parts': len(compressed_frames),
+                         'plain_bytes': sum(map(len, plain_frames)), 'compressed_bytes': sum(map(len, compressed_frames)),
+                         'plain': number / plain, 'compressed': number / packed}
+    return results
+
+
+class _LegacyChannel(object):
+    # The property-based record used for subscriptions before Channel had __slots__
+    @property
+    def callback(self):
+        return self._callback
+
+    def __init__(self, name, subscribe_on_reconnecting, callback):
+        self._name = name
+        self._subscribe_on_reconnecting = subscribe_on_reconnecting
+        self._is_subscribing = False
+        self._is_subscribed = False
+        self._callback = callback
+
+
+def bench_channels(count=100000, number=1000000):
+    on_message = lambda sender, channel, message: None
+    results = {}
+    names = ['channel%d' % i for i in range(count)]
+    for name, cls in (('legacy', _LegacyChannel), ('slots', Channel)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        channels = [cls(n, True, on_message) for n in names]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        ch = channels[0]
+        elapsed = min(timeit.repeat(lambda: ch.callback, number=number, repeat=3))
+        results[name] = {'bytes': after - before, 'lookups': number / elapsed}
+        del channels
+    return results
+
+
+def _connected_client(server, **options):
+    import ortc
+    client = ortc.OrtcClient()
+    client.cluster_url = server.cluster_url
+    for name, value in options.items():
+        setattr(client, name, value)
+    errors = []
+    for event in ('connected', 'disconnected', 'reconnected', 'reconnecting', 'subscribed', 'unsubscribed'):
+        getattr(client, 'set_on_%s_callback' % event)(lambda sender, *args: None)
+    client.set_on_exception_callback(lambda sender, error: errors.append(error))
+    client.connect('benchmark')
+    deadline = time.monotonic() + 5
+    while not client.is_connected:
+        if time.monotonic() > deadline:
+            raise OrtcError('Not connected to the stand-in server: ' + str(errors))
+        time.sleep(0.005)
+    return client
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': values[-1]}
+
+
+def bench_subscribe(counts=(100, 1000, 10000)):
+    import ortc_server
+    server = ortc_server.OrtcServer()
+    server.start()
+    results = {}
+    try:
+        for batch_parts in (False, True):
+            for count in counts:
+                client = _connected_client(server, batch_parts=batch_parts)
+                channels = ['bench:%d' % i for i in range(count)]
+                start = time.perf_counter()
+                acks = client.subscribe_many(channels, False, lambda sender, channel, message: None, 60).result(90)
+                elapsed = time.perf_counter() - start
+                assert all([error == None for error in acks.values()]), 'subscribe failed'
+                results['%s %d' % ('batched' if batch_parts else 'frames', count)] = {'seconds': elapsed, 'channels': count / elapsed}
+                client.disconnect()
+    finally:
+        server.stop(5)
+    return results
+
+
+def bench_loopback(messages=5000, sizes=(100, 4000), window=200):
+    import ortc_server
+    server = ortc_server.OrtcServer()
+    server.start()
+    results = {}
+    try:
+        for size in sizes:
+            receiver = _connected_client(server)
+            sender = _connected_client(server)
+            latencies = []
+            done = threading.Event()
+            def on_message(client, channel, message):
+                latencies.append(time.perf_counter() - float(message[:20]))
+                if len(latencies) == messages:
+                    done.set()
+            receiver.subscribe_many(['loopback'], False, on_message, 5).result(10)
+            padding = 'x' * max(0, size - 20)
+            start = time.perf_counter()
+            for i in range(messages):
+                # at most *window* messages in flight, so latency is not just queueing in the server
+                while i - len(latencies) >= window:
+                    time.sleep(0.0005)
+                sender.send('loopback', ('%20.9f' % time.perf_counter()) + padding)
+            if not done.wait(60):
+                raise OrtcError('Only %d of %d messages delivered' % (len(latencies), messages))
+            elapsed = time.perf_counter() - start
+            result = {'messages': messages / elapsed, 'bytes': messages * size / elapsed}
+            result.update(_percentiles(latencies))
+            results[size] = result
+            sender.disconnect()
+            receiver.disconnect()
+    finally:
+        server.stop(5)
+    return results
+
+
+def _environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(), 'platform': platform.platform(),
+            'machine': platform.machine(), 'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+
+BENCHMARKS = {
+    'parse': (bench_parse, {}, {'number': 2000}),
+    'reassembly': (bench_reassembly, {}, {'number': 200}),
+    'send': (bench_send, {}, {'number': 20}),
+    'compression': (bench_compression, {}, {'number': 2}),
+    'channels': (bench_channels, {}, {'count': 10000, 'number': 100000}),
+    'subscribe': (bench_subscribe, {}, {'counts': (100, 1000)}),
+    'loopback': (bench_loopback, {}, {'messages': 500}),
+}
+
+
+def run(names=None, quick=False):
+    random.seed(0)
+    results = {}
+    for name in names or list(BENCHMARKS.keys()):
+        fn, options, quick_options = BENCHMARKS[name]
+        results[name] = fn(**(quick_options if quick else options))
+    return {'environment': _environment(), 'quick': quick, 'results': results}
+
+
+def report(results):
+    r = results['results']
+    for name, rate in r.get('parse', {}).items():
+        print('parse %-8s %12.0f frames/s' % (name, rate))
+    for parts, rates in r.get('reassembly', {}).items():
+        print('reassembly %4d parts %10.0f messages/s %12.0f parts/s' % (parts, rates['messages'], rates['parts']))
+    for size, rates in r.get('send', {}).items():
+        for name, rate in rates.items():
+            print('send %7d chars %-8s %10.0f messages/s' % (size, name, rate))
+    for size, result in r.get('compression', {}).items():
+        print('compression %7d chars %4d -> %4d parts %8d -> %8d bytes %8.0f -> %8.0f messages/s' % (size, result['plain_parts'],
+              result['compressed_parts'], result['plain_bytes'], result['compressed_bytes'], result['plain'], result['compressed']))
+    for name, result in r.get('channels', {}).items():
+        print('channels %-8s %8.1f MB %12.0f callback lookups/s' % (name, result['bytes'] / 1048576.0, result['lookups']))
+    for name, result in r.get('subscribe', {}).items():
+        print('subscribe %-14s %8.3f s %12.0f channels/s' % (name, result['seconds'], result['channels']))
+    for size, result in r.get('loopback', {}).items():
+        print('loopback %6d chars %8.0f messages/s  p50 %.2f ms  p99 %.2f ms  max %.2f ms' % (size, result['messages'],
+              result['p50'] * 1000, result['p99'] * 1000, result['max'] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ORTC client benchmarks')
+    parser.add_argument('--only', help='comma separated benchmarks to run: ' + ','.join(BENCHMARKS.keys()))
+    parser.add_argument('--quick', action='store_true', help='smaller iteration counts, for a smoke run')
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON to FILE, - for stdout')
+    args = parser.parse_args()
+    names = args.only.split(',') if args.only else None
+    for name in names or []:
+        if not name in BENCHMARKS:
+            parser.error('unknown benchmark: ' + name)
+    results = run(names, args.quick)
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2, default=str)
+        print('')
+    else:
+        report(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2, default=str)
@@ -20,7 +20,18 @@ MAX_CHANNEL_NAME_SIZE = 100
 MAX_MESSAGE_SIZE = 800
 MAX_HEARTBEAT_INTERVAL = 30
 RECONNECT_INTERVAL = 5
+MAX_RECONNECT_INTERVAL = 60
 REST_TIMEOUT = 5
+MAX_BUFFERED_MESSAGES = 1000
+MAX_BUFFERED_BYTES = 16*1024*1024
+MULTIPART_TTL = 60
+PRESENCE_CACHE_TTL = 0
+COMPRESSION_THRESHOLD = 1024
+MAX_BATCH_FRAMES = 64
+RESUBSCRIBE_RATE = 1000
+RESUBSCRIBE_INTERVAL = 0.1
+
+AUTHENTICATION_HEADERS = {'User-Agent': 'OrtcPythonApi', 'Connection': 'keep-alive', 'Content-Type': 'application/x-www-form-urlencoded'}
 
 states = Private._enum_state(DISCONNECTED=0, CONNECTED=1, CONNECTING=2, RECONNECTING=3, DISCONNECTING=4)
 
@@ -67,21 +78,15 @@ def save_authentication(url, is_cluster, authentication_token, is_private, appli
     server += '/authenticate' if not server[-1] == '/' else 'authenticate'
     def p_thread():
         try:
-            from urllib.parse import urlparse
-            uri = urlparse(server)
             headers = {}
             headers['User-Agent'] = 'OrtcPythonApi'
             headers['Connection'] = 'keep-alive'
-            headers['Content-Length'] = len(post_str)
             headers['Content-Type'] = 'application/x-www-form-urlencoded'
-            conn = httplib.HTTPSConnection(uri.netloc, timeout=REST_TIMEOUT)
-            conn.request("POST", uri.path, None, headers)
-            conn.send(post_str)
-            res = conn.getresponse()
-            if res.status == 201:
+            status, data = http_pool.request("POST", server, post_str, headers, secure=True)
+            if status == 201:
                 callback(None, True)
             else:
-                callback(res.read(), False)
+                callback(data, False)
         except Exception as e:
             callback(e, False)
     t = threading.Thread(target=p_thread)
@@ -111,39 +116,75 @@ def save_authentication(url, is_cluster, authentication_token, is_private, appli
     >>> print 'Success' if r==True else 'Failed'
     Success
     '''
-    if not isinstance(channels_permissions, dict):
-        raise OrtcError('Invalid channels permissions')
-    post_str = 'AT='+authentication_token+'&AK='+application_key+'&PK='+private_key+'&TTL='+str(time_to_live)+'&PVT='+('1' if is_private==True else '0')+'&TP='+str(len(channels_permissions))
-    for k,v in channels_permissions.items():
-        if not re.compile('^[\w\-:\/.]+$').match(k):
-            raise OrtcError('Invalid channel name: '+k)
-        post_str += '&'+k+'='+v
-    server = Private._get_cluster(url, application_key) if is_cluster else url
-    if server == None:
-        raise OrtcError('Error getting server from Cluster')
-    server += '/authenticate' if not server[-1] == '/' else 'authenticate'
-    from urllib.parse import urlparse
-    uri = urlparse(server)
-    headers = {}
-    headers['User-Agent'] = 'OrtcPythonApi'
-    headers['Connection'] = 'keep-alive'
-    headers['Content-Type'] = 'application/x-www-form-urlencoded'
-    conn = http.client.HTTPSConnection(uri.netloc, timeout=REST_TIMEOUT)
-    conn.request("POST", uri.path, post_str, headers)
-    res = conn.getresponse()
-    if res.status == 201:
+    post_str = Private._authentication_body(authentication_token, is_private, application_key, time_to_live, private_key, channels_permissions)
+    server = Private._authentication_url(url, is_cluster, application_key)
+    status, data = http_pool.request("POST", server, post_str, AUTHENTICATION_HEADERS, secure=True)
+    if status == 201:
         return True
     else:
         return False
 
-def presence(url, is_cluster, application_key, authentication_token, channel, callback):
+def save_authentication_many(url, is_cluster, application_key, private_key, tokens, max_concurrency=8):
+    '''Saves the channels and their permissions of many authentication tokens at once.
+
+    The permissions are validated and the server is resolved once for all tokens, and the requests run
+    over pooled connections, at most *max_concurrency* at a time.
+
+    **Note:** This method will send your Private Key over the Internet. Make sure to use secure connection.
+
+    * *url* - The ORTC server URL.
+    * *is_cluster* - Indicates whether the ORTC server is in a cluster.
+    * *application_key* - The application key provided when the ORTC service is purchased.
+    * *private_key* - The private key provided when the ORTC service is purchased.
+    * *tokens* - A list of (authentication_token, is_private, time_to_live, channels_permissions) tuples.
+    * *max_concurrency* - The maximum number of requests sent at the same time.
+
+    Returns dictionary- *results* maps each token to whether it was saved, *errors* maps the failed tokens to
+    the reason, and *elapsed* and *max_latency* are the total and slowest request times in seconds.
+
+    Usage:
+
+    >>> tokens = [('token1', False, 1800, {'blue': 'r'}), ('token2', True, 3600, {'blue': 'w', 'yellow': 'r'})]
+    >>> r = ortc.save_authentication_many('https://ortc-developers.realtime.co/server/ssl/2.1', True, 'Your application key', 'Your private key', tokens)
+    >>> print r['results']
+    {'token1': True, 'token2': True}
+    '''
+    start = time.monotonic()
+    valid_channels = set()
+    bodies = []
+    for authentication_token, is_private, time_to_live, channels_permissions in tokens:
+        bodies.append((authentication_token, Private._authentication_body(authentication_token, is_private, application_key, time_to_live, private_key, channels_permissions, valid_channels)))
+    server = Private._authentication_url(url, is_cluster, application_key)
+    def save(token_body):
+        request_start = time.monotonic()
+        try:
+            status, data = http_pool.request("POST", server, token_body[1], AUTHENTICATION_HEADERS, secure=True)
+            error = None if status == 201 else str(status)
+        except Exception as e:
+            error = str(e)
+        return token_body[0], error, time.monotonic() - request_start
+    results = {}
+    errors = {}
+    max_latency = 0.0
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max(1, min(max_concurrency, len(bodies)))) as executor:
+        for token, error, latency in executor.map(save, bodies):
+            results[token] = error == None
+            if not error == None:
+                errors[token] = error
+            max_latency = max(max_latency, latency)
+    return {'results': results, 'errors': errors, 'elapsed': time.monotonic() - start, 'max_latency': max_latency}
+
+def presence(url, is_cluster, application_key, authentication_token, channel, callback=None):
     '''Gets a dictionary indicating the subscriptions number in the specified channel and if active the first 100 unique metadata.
     * *url* - The ORTC server URL.
     * *is_cluster* - Indicates whether the ORTC server is in a cluster.
     * *application_key* - The application key provided when the ORTC service is purchased.
     * *authentication_token* - The authentication token generated by an application server (for instance: a unique session ID).
     * *channel* - The channel name with presence data active.
-    * *callback* - The callback with error and result parameters.
+    * *callback* - The callback with error and result parameters, this parameter is optional.
+
+    Returns *Future* - Completes with the result, or fails with OrtcError. Use asyncio.wrap_future to await it.
 
     Usage:
 
@@ -153,28 +194,18 @@ def presence(url, is_cluster, application_key, authentication_token, channel, ca
     >>>     else:
     >>>         print str(result)
     >>> ortc.presence('http://ortc-developers.realtime.co/server/2.1', True, 'Your application key', 'Your authentication token', 'blue', presence_callback)
+    >>> futures = [ortc.presence('http://ortc-developers.realtime.co/server/2.1', True, 'Your application key', 'Your authentication token', c) for c in channels]
+    >>> results = [f.result(timeout=5) for f in futures]
     '''
-    server = Private._prepare_server(url, is_cluster, application_key, callback)
-    if server == None: return
-    presence_url = server+'presence/'+application_key+'/'+authentication_token+'/'+channel
-    def p_thread():
-        try:
-            from urllib.parse import urlparse
-            uri = urlparse(presence_url)
-            conn = httplib.HTTPSConnection(uri.netloc, timeout=REST_TIMEOUT)
-            conn.request("GET", uri.path)
-            res = conn.getresponse()
-            if res.status==200:
-                callback(None, json.loads(res.read()))
-            else:
-                callback(str(res.status), None)
-        except Exception as e:
-            callback(str(e), None)
-    t = threading.Thread(target=p_thread)
-    t.setDaemon(True)
-    t.start()
-
-def enable_presence(url, is_cluster, application_key, private_key, channel, metadata, callback):
+    def request():
+        server = Private._prepare_server(url, is_cluster, application_key)
+        status, data = http_pool.request("GET", server+'presence/'+application_key+'/'+authentication_token+'/'+channel, secure=True)
+        if not status==200:
+            raise OrtcError(str(status))
+        return json.loads(data)
+    return Private._rest_submit(request, callback)
+
+def enable_presence(url, is_cluster, application_key, private_key, channel, metadata, callback=None):
     '''Enables presence for the specified channel with first 100 unique metadata if true.
 
     **Note:** This method will send your Private Key over the Internet. Make sure to use secure connection.
@@ -185,7 +216,9 @@ def enable_presence(url, is_cluster, application_key, private_key, channel, meta
     * *private_key* - The private key provided when the ORTC service is purchased.
     * *channel* - The channel name to activate presence.
     * *metadata* - Defines if to collect first 100 unique metadata (boolean).
-    * *callback* - The callback with error and result parameters.
+    * *callback* - The callback with error and result parameters, this parameter is optional.
+
+    Returns *Future* - Completes with the result, or fails with OrtcError. Use asyncio.wrap_future to await it.
 
     Usage:
 
@@ -196,13 +229,13 @@ def enable_presence(url, is_cluster, application_key, private_key, channel, meta
     >>>         print str(result)
     >>> ortc.enable_presence('http://ortc-developers.realtime.co/server/2.1', True, 'Your application key', 'Your private key', 'blue', True, presence_callback)
     '''
-    server = Private._prepare_server(url, is_cluster, application_key, callback)
-    if server == None: return
-    presence_url = server+'presence/enable/'+application_key+'/'+channel
-    content = 'privatekey='+private_key+ ('&metadata=1' if metadata else '&metadata=0')
-    Private._rest_post_request(presence_url, content, callback)
+    def request():
+        server = Private._prepare_server(url, is_cluster, application_key)
+        content = 'privatekey='+private_key+ ('&metadata=1' if metadata else '&metadata=0')
+        return Private._rest_post(server+'presence/enable/'+application_key+'/'+channel, content)
+    return Private._rest_submit(request, callback)
 
-def disable_presence(url, is_cluster, application_key, private_key, channel, callback):
+def disable_presence(url, is_cluster, application_key, private_key, channel, callback=None):
     '''Disables presence for the specified channel.
 
     **Note:** This method will send your Private Key over the Internet. Make sure to use secure connection.
@@ -212,7 +245,9 @@ def disable_presence(url, is_cluster, application_key, private_key, channel, cal
     * *application_key* - The application key provided when the ORTC service is purchased.
     * *private_key* - The private key provided when the ORTC service is purchased.
     * *channel* - The channel name to disable presence.
-    * *callback* - The callback with error and result parameters.
+    * *callback* - The callback with error and result parameters, this parameter is optional.
+
+    Returns *Future* - Completes with the result, or fails with OrtcError. Use asyncio.wrap_future to await it.
 
     Usage:
 
@@ -223,11 +258,10 @@ def disable_presence(url, is_cluster, application_key, private_key, channel, cal
     >>>         print str(result)
     >>> ortc.disable_presence('http://ortc-developers.realtime.co/server/2.1', True, 'Your application key', 'Your private key', 'blue', presence_callback)
     '''
-    server = Private._prepare_server(url, is_cluster, application_key, callback)
-    if server == None: return
-    presence_url = server+'presence/disable/'+application_key+'/'+channel
-    content = 'privatekey='+private_key
-    Private._rest_post_request(presence_url, content, callback)
+    def request():
+        server = Private._prepare_server(url, is_cluster, application_key)
+        return Private._rest_post(server+'presence/disable/'+application_key+'/'+channel, 'privatekey='+private_key)
+    return Private._rest_submit(request, callback)
 
 
 class OrtcClient(object):
@@ -307,23 +341,305 @@ class OrtcClient(object):
         '''
         return self._session_id
 
+    @property
+    def frame_stats(self):
+        '''Counters of the SockJS frames received and the messages batched in them (read only)
+
+        Usage:
+
+        >>> print ortc_client.frame_stats
+        {'frames': 120, 'elements': 410, 'max_elements': 12}
+        '''
+        return {'frames': self._decoder.frames, 'elements': self._decoder.elements, 'max_elements': self._decoder.max_elements}
+
+    @property
+    def batch_parts(self):
+        '''Indicates whether all the parts of a multipart message are written to the socket at once
+
+        Usage:
+
+        >>> ortc_client.batch_parts = True
+        '''
+        return self._batch_parts
+    @batch_parts.setter
+    def batch_parts(self, batch_parts):
+        self._batch_parts = batch_parts
+
+    @property
+    def send_queue_size(self):
+        '''The maximum number of frames waiting in the send queue, 0 (the default) sends on the caller's thread
+
+        When set, send() only queues the frames and a writer thread writes them to the socket.
+        It takes effect on the next connect.
+
+        Usage:
+
+        >>> ortc_client.send_queue_size = 10000
+        '''
+        return self._send_queue_size
+    @send_queue_size.setter
+    def send_queue_size(self, send_queue_size):
+        self._send_queue_size = send_queue_size
+
+    @property
+    def send_queue_overflow(self):
+        '''What send() does when the send queue is full: overflow_policies.BLOCK (the default), DROP_OLDEST or RAISE
+
+        DROP_OLDEST drops whole messages, with all their parts, and send_queue_stats counts them as *dropped*.
+
+        Usage:
+
+        >>> ortc_client.send_queue_overflow = ortc.overflow_policies.DROP_OLDEST
+        '''
+        return self._send_queue_overflow
+    @send_queue_overflow.setter
+    def send_queue_overflow(self, send_queue_overflow):
+        self._send_queue_overflow = send_queue_overflow
+        if not self._send_queue == None:
+            self._send_queue.overflow = send_queue_overflow
+
+    @property
+    def send_queue_stats(self):
+        '''Counters of the send queue (read only)
+
+        Usage:
+
+        >>> print ortc_client.send_queue_stats
+        {'depth': 0, 'max_depth': 310, 'dropped': 0, 'sent': 5200, 'writes': 410}
+        '''
+        q = self._send_queue
+        if q == None:
+            return {'depth': 0, 'max_depth': 0, 'dropped': 0, 'sent': 0, 'writes': 0}
+        return {'depth': q.depth, 'max_depth': q.max_depth, 'dropped': q.dropped, 'sent': q.sent, 'writes': q.writes}
+
+    @property
+    def dispatcher(self):
+        '''The Dispatcher running the on_message callbacks, by default inline on the receive thread
+
+        A full queue drops its oldest message unless the Dispatcher is given
+        another overflow policy. overflow_policies.BLOCK holds the receive
+        thread, and so every channel, until the slow channel catches up.
+
+        Usage:
+
+        >>> ortc_client.dispatcher = ortc.Dispatcher(ortc.dispatch_modes.PER_CHANNEL, workers=8, max_queue=1000)
+        >>> print ortc_client.dispatcher.max_lag
+        0.0021
+        '''
+        return self._dispatcher
+    @dispatcher.setter
+    def dispatcher(self, dispatcher):
+        if dispatcher.on_error == None:
+            dispatcher.on_error = self._on_error
+        previous = self._dispatcher
+        self._dispatcher = dispatcher
+        if not previous is dispatcher:
+            previous.close()
+
+    @property
+    def presence_cache_ttl(self):
+        '''The time, in seconds, a presence result is reused by presence() (0, the default, only shares requests in flight)
+
+        Usage:
+
+        >>> ortc_client.presence_cache_ttl = 5
+        '''
+        return self._presence_cache.ttl
+    @presence_cache_ttl.setter
+    def presence_cache_ttl(self, presence_cache_ttl):
+        self._presence_cache.ttl = presence_cache_ttl
+
+    @property
+    def resubscribe_rate(self):
+        '''The maximum number of channels subscribed per second after a reconnect, 0 for no limit
+
+        Channels are resubscribed in order of the priority given to subscribe().
+
+        Usage:
+
+        >>> ortc_client.resubscribe_rate = 200
+        '''
+        return self._resubscribe_rate
+    @resubscribe_rate.setter
+    def resubscribe_rate(self, resubscribe_rate):
+        self._resubscribe_rate = resubscribe_rate
+
+    @property
+    def metrics(self):
+        '''The counters, gauges and latency histograms of the client (read only)
+
+        Histograms, in seconds: receive, parse, dispatch, send, subscribe_ack, rest, receive_gap (the time between
+        two received frames, heartbeats included) and delivery (the end-to-end latency of messages, when tracing). See ortc_extensibility.Metrics for snapshots and the Prometheus
+        format, and ortc_extensibility.StatsDExporter to push them to StatsD.
+
+        Usage:
+
+        >>> print ortc_client.metrics.snapshot()['histograms']['parse']['p99']
+        >>> exporter = ortc.StatsDExporter(ortc_client.metrics, 'localhost', 8125)
+        '''
+        return self._metrics
+
+    @property
+    def compression(self):
+        '''Indicates whether messages of at least compression_threshold characters are sent compressed
+
+        Messages are compressed with zlib and encoded as Base64 text before they are split in parts, and only when
+        that makes them smaller. Receiving clients of this version decompress them after reassembly, whatever their
+        own setting; older clients receive the encoded text. Binary messages are compressed too. A received message
+        that decompresses to more than MAX_DECOMPRESSED_SIZE bytes is dropped and reported to the exception callback.
+
+        Usage:
+
+        >>> ortc_client.compression = True
+        '''
+        return self._compression.enabled
+    @compression.setter
+    def compression(self, compression):
+        self._compression.enabled = compression
+
+    @property
+    def compression_threshold(self):
+        '''The minimum size, in characters, of a message to compress
+
+        Usage:
+
+        >>> ortc_client.compression_threshold = 4096
+        '''
+        return self._compression.threshold
+    @compression_threshold.setter
+    def compression_threshold(self, compression_threshold):
+        self._compression.threshold = compression_threshold
+
+    @property
+    def compression_dictionary(self):
+        '''The bytes, typical of the messages, compressed messages are primed with, None (the default) for none
+
+        The sending and the receiving clients must use the same dictionary.
+
+        Usage:
+
+        >>> ortc_client.compression_dictionary = b'{"symbol":"","price":,"volume":}'
+        '''
+        return self._compression.dictionary
+    @compression_dictionary.setter
+    def compression_dictionary(self, compression_dictionary):
+        self._compression.dictionary = compression_dictionary
+
+    @property
+    def binary_messages(self):
+        '''Indicates whether binary messages, sent as bytes, are received as bytes
+
+        Otherwise the on_message callbacks receive them as the text they were encoded to, as older clients do.
+
+        Usage:
+
+        >>> ortc_client.binary_messages = True
+        '''
+        return self._binary_messages
+    @binary_messages.setter
+    def binary_messages(self, binary_messages):
+        self._binary_messages = binary_messages
+
+    @property
+    def tracing(self):
+        '''Indicates whether sent messages carry a timestamp and a sequence number in their message id, and whether received ones are measured
+
+        Enable it on both the sending and the subscribing clients. Payloads are unchanged, and the end-to-end latency of the traced
+        messages is recorded in the *delivery* histogram of metrics and per channel by trace_stats().
+
+        Usage:
+
+        >>> ortc_client.tracing = True
+        '''
+        return not self._tracer == None
+    @tracing.setter
+    def tracing(self, tracing):
+        if not tracing:
+            self._tracer = None
+        elif self._tracer == None:
+            self._tracer = Tracer()
+
+    def trace_stats(self, channel=None):
+        '''Gets the end-to-end delivery statistics of the traced messages received, when tracing is enabled.
+
+        * *channel* - The channel name, this parameter is optional.
+
+        Returns *dictionary* - The count, gaps, reordered and duplicate messages and the latency histogram of the channel, or of every channel by name if omitted.
+
+        Usage:
+
+        >>> print ortc_client.trace_stats('blue')['latency']['p99']
+        0.012
+        '''
+        if self._tracer == None:
+            return None
+        return self._tracer.stats(channel)
+
+    @property
+    def resubscribe_stats(self):
+        '''Statistics of the last resubscription after a reconnect, None if there was none (read only)
+
+        *elapsed* is the time in seconds until every channel was restored, or so far when *done* is False.
+
+        Usage:
+
+        >>> print ortc_client.resubscribe_stats
+        {'total': 10000, 'requested': 10000, 'restored': 10000, 'pending': 0, 'elapsed': 10.2, 'done': True}
+        '''
+        if self._resubscription == None:
+            return None
+        return self._resubscription.stats()
+
     def __init__(self):
         self.app_key = None
         self.auth_token = None
+        self.on_exception_callback = None
+        self.on_connected_callback = None
+        self.on_disconnected_callback = None
+        self.on_reconnected_callback = None
+        self.on_reconnecting_callback = None
+        self.on_subscribed_callback = None
+        self.on_unsubscribed_callback = None
+        self.on_message_evicted_callback = None
+        self.on_resubscribe_progress_callback = None
         self._announcement_subchannel = ''
         self._connection_metadata = ''
         self._state = states.DISCONNECTED
         self._url = None
         self._cluster_url = None
         self._session_id = None
-        self._permissions = {}
+        self._permissions = PermissionIndex()
         self._channels = {}
         self._ws = None
-        self._messages_buffer = {}
-        self.heartbeat_timer = None
-        self.reconnecting_thread = None
-        self.heartbeat_thread = None
-        self.got_heartbeat = False
+        self._messages_buffer = MessageBuffer(MAX_BUFFERED_MESSAGES, MAX_BUFFERED_BYTES, MULTIPART_TTL, self._on_message_evicted)
+        self._decoder = FrameDecoder()
+        self._encoder = None
+        self._batch_parts = False
+        self._send_queue = None
+        self._send_queue_size = 0
+        self._dispatcher = Dispatcher()
+        self._presence_cache = PresenceCache(PRESENCE_CACHE_TTL)
+        self._send_queue_overflow = overflow_policies.BLOCK
+        self._send_lock = threading.Lock()
+        self._scheduler = Scheduler.shared()
+        self._acks = AckTracker(self._scheduler)
+        self._resubscribe_rate = RESUBSCRIBE_RATE
+        self._resubscription = None
+        self._resubscribe_queue = None
+        self._subscribe_times = {}
+        self._tracer = None
+        self._compression = PayloadCodec(False, COMPRESSION_THRESHOLD)
+        self._binary_messages = False
+        self._metrics = Metrics()
+        self._metrics.gauge('channels', lambda: len(self._channels))
+        self._metrics.gauge('reassembly_messages', lambda: len(self._messages_buffer))
+        self._metrics.gauge('reassembly_bytes', lambda: self._messages_buffer.bytes)
+        self._metrics.gauge('send_queue_depth', lambda: self._send_queue.depth if not self._send_queue == None else 0)
+        self._metrics.gauge('dispatch_queue_depth', lambda: self._dispatcher.depth())
+        self._heartbeat_timer = None
+        self._reconnect_timer = None
+        self._reconnect_attempts = 0
+        self._last_received = 0
         self.keep_running = True
 
     def connect(self, application_key, authentication_token='PM.Anonymous'):
@@ -340,6 +656,7 @@ class OrtcClient(object):
         '''
         self.app_key = application_key
         self.auth_token = authentication_token
+        self._presence_cache.invalidate()
         if self.is_connected:
             Private._call_exception_callback(self, 'Already connected')
         elif self._state == states.CONNECTING:
@@ -376,17 +693,35 @@ class OrtcClient(object):
             self._session_id = ''.join(random.choice(string.ascii_letters + string.digits) for x in range(16))
             from random import randint
             ws_url = 'ws'+server[4:]+'/broadcast/'+str(randint(0,1000))+'/'+rand_str+'/websocket'
+            self._encoder = FrameEncoder(self.app_key, self.auth_token, MAX_MESSAGE_SIZE)
             self.keep_running = True
             from websocket import create_connection
-            self._ws = create_connection(ws_url)
+            # a socket opened by an earlier attempt, but never validated, is replaced
+            if not self._ws == None:
+                try:
+                    self._ws.close()
+                except Exception:
+                    pass
+            try:
+                # text frames are still decoded by the strict C codec, which rejects invalid UTF-8
+                self._ws = create_connection(ws_url, skip_utf8_validation=True)
+            except Exception:
+                if not self.cluster_url == None:
+                    cluster_cache.invalidate(self.cluster_url, self.app_key)
+                raise
+            if self._send_queue == None and self._send_queue_size > 0:
+                self._send_queue = SendQueue(self._write, self._send_queue_size, self._send_queue_overflow, self._on_error)
+            ws = self._ws
             def runloop():
-                while self.keep_running:
+                while self.keep_running and self._ws is ws:
                     try:
-                        r = self._ws.recv()
-                        self._on_message(self._ws, r)
+                        r = ws.recv()
+                        self._on_message(ws, r)
                     except Exception as e:
-                        print(e)
-                        pass
+                        if not ws.connected:
+                            break
+                        self._metrics.incr('receive_errors')
+                        Private._call_exception_callback(self, str(e))
             self.main_loop = threading.Thread(target=runloop)
             self.main_loop.setDaemon(True)
             self.main_loop.start()
@@ -402,9 +737,15 @@ class OrtcClient(object):
             Private._call_exception_callback(self, 'Not connected')
             return
         self._channels.clear()
+        self._acks.fail_all('Disconnected')
+        self._subscribe_times.clear()
+        self._cancel_resubscription()
         self._state=states.DISCONNECTING
-        self.monit_heartbeat = False
+        self._cancel_timers()
         self.keep_running = False
+        if not self._send_queue == None:
+            self._send_queue.close()
+            self._send_queue = None
         self._ws.close()
         if self.on_disconnected_callback:
             self.on_disconnected_callback(self)
@@ -427,12 +768,13 @@ class OrtcClient(object):
                 return True
         return False
 
-    def subscribe(self, channel, subscribe_on_reconnect, on_message):
+    def subscribe(self, channel, subscribe_on_reconnect, on_message, priority=priorities.NORMAL):
         '''Subscribes to the supplied channel to receive messages sent to it.
 
         * *channel* - The channel name.
         * *subscribe_on_reconnect* -Indicates whether the client should subscribe to the channel when reconnected (if it was previously subscribed when connected).
         * *on_message* - The callback called when a message arrives at the channel.
+        * *priority* - The order in which the channel is resubscribed after a reconnect, one of ortc.priorities, this parameter is optional.
 
         Usage:
 
@@ -440,16 +782,13 @@ class OrtcClient(object):
         >>>     print 'Message received on ('+channel+'): ' + message
         >>> ortc_client.subscribe('blue', True, on_message)
         '''
+        channel_error = Private._channel_error(channel, MAX_CHANNEL_NAME_SIZE)
         if not self.is_connected:
             Private._call_exception_callback(self, 'Not connected')
-        elif not isinstance(channel, str) or len(channel)<1:
-            Private._call_exception_callback(self, 'Channel is null or empty or not a string')
-        elif not Private._validate_input(channel):
-            Private._call_exception_callback(self, 'Channel has invalid characters')
+        elif channel_error:
+            Private._call_exception_callback(self, channel_error)
         elif channel in self._channels and self._channels[channel].is_subscribed:
             Private._call_exception_callback(self, 'Already subscribing to the channel \''+channel+'\'')
-        elif len(channel) > MAX_CHANNEL_NAME_SIZE:
-            Private._call_exception_callback(self, 'Channel size exceeds the limit of ' + str(MAX_CHANNEL_NAME_SIZE) + ' characters')
         elif not hasattr(on_message, '__call__'):
             Private._call_exception_callback(self, 'The argument \'onMessageCallback\' must be a function')
         else:
@@ -457,10 +796,11 @@ class OrtcClient(object):
             if not has_permission:
                 Private._call_exception_callback(self, 'No permissions found to subscribe channel: '+channel)
                 return
-            ch = Channel(channel, subscribe_on_reconnect, on_message)
+            ch = Channel(channel, subscribe_on_reconnect, on_message, priority)
             ch.is_subscribing = True
             self._channels[channel] = ch
-            self._ws.send(json.dumps('subscribe;'+self.app_key+';'+self.auth_token+';'+channel+';'+phash))
+            self._subscribe_times[channel] = time.monotonic()
+            self._write(json.dumps('subscribe;'+self.app_key+';'+self.auth_token+';'+channel+';'+phash))
 
 
     def unsubscribe(self, channel):
@@ -472,53 +812,263 @@ class OrtcClient(object):
 
         >>> ortc_client.unsubscribe('blue')
         '''
+        channel_error = Private._channel_error(channel, MAX_CHANNEL_NAME_SIZE)
         if not self.is_connected:
             Private._call_exception_callback(self, 'Not connected')
-        elif not isinstance(channel, str) or len(channel)<1:
-            Private._call_exception_callback(self, 'Channel is null or empty or not a string')
-        elif not Private._validate_input(channel):
-            Private._call_exception_callback(self, 'Channel has invalid characters')
+        elif channel_error:
+            Private._call_exception_callback(self, channel_error)
         elif not channel in self._channels:
             Private._call_exception_callback(self, 'Not subscribed to the channel \''+channel+'\'')
-        elif len(channel) > MAX_CHANNEL_NAME_SIZE:
-            Private._call_exception_callback(self, 'Channel size exceeds the limit of ' + str(MAX_CHANNEL_NAME_SIZE) + ' characters')
         else:
-            self._channels[channel].subscribe_on_reconnected = False
-            self._ws.send(json.dumps('unsubscribe;'+self.app_key+';'+channel))
+            self._channels[channel].subscribe_on_reconnecting = False
+            self._write(json.dumps('unsubscribe;'+self.app_key+';'+channel))
+
+    def subscribe_many(self, channels, subscribe_on_reconnect, on_message, timeout=None, priority=priorities.NORMAL):
+        '''Subscribes to the supplied channels, writing all the subscribe requests at once.
+
+        Channels that fail validation are not requested and their error is reported in the result.
+        Channels the server rejects, or does not confirm within *timeout*, are forgotten and not resubscribed on reconnect.
+
+        * *channels* - The channel names.
+        * *subscribe_on_reconnect* - Indicates whether the client should subscribe to the channels when reconnected (if they were previously subscribed when connected).
+        * *on_message* - The callback called when a message arrives at any of the channels.
+        * *timeout* - The maximum time to wait for the server to confirm the subscriptions, in seconds. Waits indefinitely if omitted.
+        * *priority* - The order in which the channels are resubscribed after a reconnect, one of ortc.priorities, this parameter is optional.
+
+        Returns *Future* - Completes with a dictionary of channel to error, None for each channel the server confirmed.
+
+        Usage:
+
+        >>> future = ortc_client.subscribe_many(['blue', 'yellow'], True, on_message, 10)
+        >>> print future.result()
+        {'blue': None, 'yellow': None}
+        '''
+        error = None
+        if not self.is_connected:
+            error = 'Not connected'
+        elif not hasattr(on_message, '__call__'):
+            error = 'The argument \'onMessageCallback\' must be a function'
+        if error:
+            Private._call_exception_callback(self, error)
+        results = {}
+        keys = []
+        requested = {}
+        frames = []
+        for channel in channels:
+            channel_error = error or Private._channel_error(channel, MAX_CHANNEL_NAME_SIZE)
+            if not channel_error and (channel in results or channel in requested):
+                continue
+            if not channel_error and channel in self._channels and self._channels[channel].is_subscribed:
+                channel_error = 'Already subscribing to the channel \''+channel+'\''
+            if not channel_error:
+                has_permission, phash = Private._check_permission(self._permissions, channel)
+                if not has_permission:
+                    channel_error = 'No permissions found to subscribe channel: '+channel
+            if channel_error:
+                results[channel] = channel_error
+                continue
+            ch = Channel(channel, subscribe_on_reconnect, on_message, priority)
+            ch.is_subscribing = True
+            self._channels[channel] = ch
+            keys.append(('subscribe', channel))
+            requested[channel] = ch
+            frames.append(json.dumps('subscribe;'+self.app_key+';'+self.auth_token+';'+channel+';'+phash))
+        batch = self._acks.track(keys, results, timeout)
+        now = time.monotonic()
+        for channel in requested:
+            self._subscribe_times[channel] = now
+        batch.future.add_done_callback(lambda future: self._drop_failed_subscriptions(requested, future.result()))
+        self._write_frames(frames, batch)
+        return batch.future
+
+    def unsubscribe_many(self, channels, timeout=None):
+        '''Unsubscribes from the supplied channels, writing all the unsubscribe requests at once.
+
+        Channels that fail validation are not requested and their error is reported in the result.
+
+        * *channels* - The channel names.
+        * *timeout* - The maximum time to wait for the server to confirm, in seconds. Waits indefinitely if omitted.
+
+        Returns *Future* - Completes with a dictionary of channel to error, None for each channel the server confirmed.
+
+        Usage:
+
+        >>> ortc_client.unsubscribe_many(['blue', 'yellow']).result(10)
+        {'blue': None, 'yellow': None}
+        '''
+        error = None
+        if not self.is_connected:
+            error = 'Not connected'
+            Private._call_exception_callback(self, error)
+        results = {}
+        keys = []
+        requested = set()
+        frames = []
+        for channel in channels:
+            channel_error = error or Private._channel_error(channel, MAX_CHANNEL_NAME_SIZE)
+            if not channel_error and (channel in results or channel in requested):
+                continue
+            if not channel_error and not channel in self._channels:
+                channel_error = 'Not subscribed to the channel \''+channel+'\''
+            if channel_error:
+                results[channel] = channel_error
+                continue
+            self._channels[channel].subscribe_on_reconnecting = False
+            keys.append(('unsubscribe', channel))
+            requested.add(channel)
+            frames.append(json.dumps('unsubscribe;'+self.app_key+';'+channel))
+        batch = self._acks.track(keys, results, timeout)
+        self._write_frames(frames, batch)
+        return batch.future
+
+    def _write_frames(self, frames, batch):
+        # pipelines the requests of a batch, as SockJS message arrays when batch_parts is set
+        try:
+            if not self._send_queue == None:
+                if frames:
+                    self._send_queue.put(frames)
+            elif self._batch_parts:
+                for i in range(0, len(frames), MAX_BATCH_FRAMES):
+                    self._write(FrameEncoder.batch(frames[i:i+MAX_BATCH_FRAMES]))
+            else:
+                for frame in frames:
+                    self._write(frame)
+        except Exception as e:
+            if not batch == None:
+                self._acks.fail(batch, str(e))
+            Private._call_exception_callback(self, str(e))
+
+    def _resubscribe(self, channels):
+        # called by the resubscription on the scheduler thread with the next channels to restore
+        requested = []
+        frames = []
+        for channel in channels:
+            ch = self._channels.get(channel)
+            if ch == None or ch.is_subscribed or not self.is_connected:
+                continue
+            has_permission, phash = Private._check_permission(self._permissions, channel)
+            if not has_permission:
+                Private._call_exception_callback(self, 'No permissions found to subscribe channel: '+channel)
+                continue
+            ch.is_subscribing = True
+            requested.append(channel)
+            frames.append(json.dumps('subscribe;'+self.app_key+';'+self.auth_token+';'+channel+';'+phash))
+        now = time.monotonic()
+        for channel in requested:
+            self._subscribe_times[channel] = now
+        if frames:
+            # written by another thread, a stalled socket must not hold up the scheduler
+            if self._resubscribe_queue == None:
+                # unbounded, so put() never blocks: a resubscription requests each channel once
+                self._resubscribe_queue = SendQueue(self._write, 2**31, overflow_policies.BLOCK, self._on_error, MAX_BATCH_FRAMES)
+            self._resubscribe_queue.put(frames)
+        return requested
+
+    def _cancel_resubscription(self):
+        if not self._resubscription == None:
+            self._resubscription.cancel()
+        if not self._resubscribe_queue == None:
+            self._resubscribe_queue.close()
+            self._resubscribe_queue = None
+
+    def _on_resubscribe_progress(self, restored, total):
+        if self.on_resubscribe_progress_callback:
+            self.on_resubscribe_progress_callback(self, restored, total)
 
 
     def send(self, channel, message):
         '''Sends the supplied message to the supplied channel.
 
         * *channel* - The channel name.
-        * *message* - The message to send.
+        * *message* - The message to send, a string or a bytes-like object (bytes, bytearray or memoryview).
 
         Usage:
 
         >>> ortc_client.send('blue', 'This is a message')
+        >>> ortc_client.send('blue', protobuf_message.SerializeToString())
         '''
+        channel_error = Private._channel_error(channel, MAX_CHANNEL_NAME_SIZE)
         if not self.is_connected:
             Private._call_exception_callback(self, 'Not connected')
-        elif not isinstance(channel, str) or len(channel)<1:
-            Private._call_exception_callback(self, 'Channel is null or empty or not a string')
-        elif not Private._validate_input(channel):
-            Private._call_exception_callback(self, 'Channel has invalid characters')
-        elif not isinstance(message, str) or len(message)<1:
-            Private._call_exception_callback(self, 'Message is null or empty or not a string')
-        elif len(channel) > MAX_CHANNEL_NAME_SIZE:
-            Private._call_exception_callback(self, 'Channel size exceeds the limit of ' + str(MAX_CHANNEL_NAME_SIZE) + ' characters')
+        elif channel_error:
+            Private._call_exception_callback(self, channel_error)
+        elif not isinstance(message, (str, bytes, bytearray, memoryview)) or len(message)<1:
+            Private._call_exception_callback(self, 'Message is null or empty or not a string or bytes')
         else:
             has_permission, phash = Private._check_permission(self._permissions, channel)
             if not has_permission:
                 Private._call_exception_callback(self, 'No permissions found to send to channel: '+channel)
                 return
-            message_id = ''.join(random.choice(string.ascii_letters + string.digits) for x in range(8))
-            parts = [message[i:i+MAX_MESSAGE_SIZE] for i in range(0, len(message), MAX_MESSAGE_SIZE)]
-            for i, p in enumerate(parts):
+            start = time.perf_counter()
+            if self._tracer == None:
+                message_id = ''.join(random.choice(string.ascii_letters + string.digits) for x in range(8))
+            else:
+                message_id = self._tracer.message_id(channel)
+            if self._compression.enabled or not isinstance(message, str):
                 try:
-                    self._ws.send(json.dumps('send;'+self.app_key+';'+self.auth_token+';'+channel+';'+phash+';'+message_id+'_'+str(i+1)+'-'+str(len(parts))+'_'+p))
-                except Exception as e:
-                    Private._call_exception_callback(self, str(e))
+                    prefix, message = self._compression.encode(message)
+                except (TypeError, ValueError) as e:
+                    Private._call_exception_callback(self, 'Unable to encode the message: ' + str(e))
+                    return
+                message_id = prefix + message_id
+            frames = self._encoder.send_frames(channel, phash, message_id, message)
+            metrics = self._metrics
+            metrics.incr('messages_sent')
+            metrics.incr('frames_sent', len(frames))
+            metrics.incr('bytes_sent', sum([len(frame) for frame in frames]))
+            try:
+                if not self._send_queue == None:
+                    self._send_queue.put(frames)
+                elif self._batch_parts and len(frames) > 1:
+                    self._write(FrameEncoder.batch(frames))
+                else:
+                    for frame in frames:
+                        self._write(frame)
+            except OrtcError:
+                metrics.incr('send_errors')
+                raise
+            except Exception as e:
+                metrics.incr('send_errors')
+                Private._call_exception_callback(self, str(e))
+            metrics.observe('send', time.perf_counter() - start)
+
+    def flush(self, timeout=None):
+        '''Waits until every message queued by send() is written to the socket.
+
+        * *timeout* - The maximum time to wait, in seconds. Waits indefinitely if omitted.
+
+        Returns *boolean* - Indicates whether the send queue was drained before the timeout.
+
+        Usage:
+
+        >>> ortc_client.send('blue', 'This is a message')
+        >>> ortc_client.flush(5)
+        True
+        '''
+        if self._send_queue == None:
+            return True
+        return self._send_queue.drain(timeout)
+
+    def _drop_failed_subscriptions(self, requested, results):
+        # the caller is told these subscriptions failed, so a late ack or a reconnect must not restore them
+        for channel, ch in requested.items():
+            if results.get(channel) and self._channels.get(channel) is ch and not ch.is_subscribed:
+                self._channels.pop(channel, None)
+                self._subscribe_times.pop(channel, None)
+
+    def _write(self, data):
+        # the only place writing to the socket, so the writer thread and the callers never interleave
+        with self._send_lock:
+            self._ws.send(data)
+
+    def _on_error(self, e):
+        Private._call_exception_callback(self, str(e))
+
+    def _on_timer_error(self, e):
+        # without an exception callback the scheduler prints the error instead
+        if not self.on_exception_callback:
+            raise e
+        Private._call_exception_callback(self, str(e))
 
     def set_on_exception_callback(self, callback):
         '''Sets the callback which occurs when there is an exception.
@@ -611,11 +1161,42 @@ class OrtcClient(object):
         '''
         self.on_unsubscribed_callback = callback
 
+    def set_on_message_evicted_callback(self, callback):
+        '''Sets the callback which occurs when an incomplete multipart message is dropped from the reassembly buffer.
+
+        A message is dropped when one of its parts did not arrive within MULTIPART_TTL seconds, or when the buffer
+        exceeds MAX_BUFFERED_MESSAGES messages or MAX_BUFFERED_BYTES characters.
+
+        * *callback* - Method to be interpreted when a multipart message is dropped.
 
-    def presence(self, channel, callback):
+        Usage:
+
+        >>> def on_message_evicted(sender, channel, message_id):
+        >>>     print 'Dropped message ' + message_id + ' on: ' + channel
+        >>> ortc_client.set_on_message_evicted_callback(on_message_evicted)
+        '''
+        self.on_message_evicted_callback = callback
+
+    def set_on_resubscribe_progress_callback(self, callback):
+        '''Sets the callback which occurs when the server confirms a channel resubscribed after a reconnect.
+
+        * *callback* - Method to be interpreted with the number of channels restored so far and the number to restore.
+
+        Usage:
+
+        >>> def on_resubscribe_progress(sender, restored, total):
+        >>>     print 'Restored ' + str(restored) + ' of ' + str(total) + ' channels'
+        >>> ortc_client.set_on_resubscribe_progress_callback(on_resubscribe_progress)
+        '''
+        self.on_resubscribe_progress_callback = callback
+
+
+    def presence(self, channel, callback=None):
         '''Gets a dictionary indicating the subscriptions number in the specified channel and if active the first 100 unique metadata.
         * *channel* - The channel name with presence data active.
-        * *callback* - The callback with error and result parameters.
+        * *callback* - The callback with error and result parameters, this parameter is optional.
+
+        Returns *Future* - Completes with the result, or fails with OrtcError.
 
         Usage:
 
@@ -626,11 +1207,39 @@ class OrtcClient(object):
         >>>         print str(result)
         >>> ortc_client.presence('blue', presence_callback)
         '''
-        is_ok, server = Private._prepare_server_internal(self.url, self.cluster_url, self.app_key, callback)
-        if is_ok:
-            presence(server, False, self.app_key, self.auth_token, channel, callback)
+        if self.app_key == None:
+            return Private._rest_error('Please, do connect first', callback)
+        if self.cluster_url == None:
+            fetch = lambda: self._timed_rest(presence(self.url, False, self.app_key, self.auth_token, channel))
+        else:
+            fetch = lambda: self._timed_rest(presence(self.cluster_url, True, self.app_key, self.auth_token, channel))
+        future = self._presence_cache.get(channel, fetch)
+        if callback:
+            future.add_done_callback(lambda f: Private._rest_callback(f, callback))
+        return future
+
+    def presence_many(self, channels, timeout=None):
+        '''Gets the presence of many channels, fetched in parallel.
 
-    def enable_presence(self, private_key, channel, metadata, callback):
+        * *channels* - The channel names with presence data active.
+        * *timeout* - The maximum time to wait for all the results, in seconds.
+
+        Returns *dictionary* - The presence result of each channel, or None for the channels whose lookup failed.
+
+        Usage:
+
+        >>> print ortc_client.presence_many(['blue', 'yellow'])
+        {'blue': {'subscriptions': 2}, 'yellow': {'subscriptions': 0}}
+        '''
+        futures = dict([(channel, self.presence(channel)) for channel in channels])
+        from concurrent.futures import wait
+        wait(list(futures.values()), timeout)
+        results = {}
+        for channel, future in futures.items():
+            results[channel] = future.result() if future.done() and future.exception() == None else None
+        return results
+
+    def enable_presence(self, private_key, channel, metadata, callback=None):
         '''Enables presence for the specified channel with first 100 unique metadata if true.
 
         **Note:** This method will send your Private Key over the Internet. Make sure to use secure connection.
@@ -638,7 +1247,9 @@ class OrtcClient(object):
         * *private_key* - The private key provided when the ORTC service is purchased.
         * *channel* - The channel name to activate presence.
         * *metadata* - Defines if to collect first 100 unique metadata (boolean).
-        * *callback* - The callback with error and result parameters.
+        * *callback* - The callback with error and result parameters, this parameter is optional.
+
+        Returns *Future* - Completes with the result, or fails with OrtcError.
 
         Usage:
 
@@ -649,18 +1260,26 @@ class OrtcClient(object):
         >>>         print str(result)
         >>> ortc_client.enable_presence('Your private key', 'blue', True, presence_callback)
         '''
-        is_ok, server = Private._prepare_server_internal(self.url, self.cluster_url, self.app_key, callback)
-        if is_ok:
-            enable_presence(server, False, self.app_key, private_key, channel, metadata, callback)
+        if self.app_key == None:
+            return Private._rest_error('Please, do connect first', callback)
+        self._presence_cache.invalidate(channel)
+        if self.cluster_url == None:
+            future = self._timed_rest(enable_presence(self.url, False, self.app_key, private_key, channel, metadata, callback))
+        else:
+            future = self._timed_rest(enable_presence(self.cluster_url, True, self.app_key, private_key, channel, metadata, callback))
+        future.add_done_callback(lambda f: self._presence_cache.invalidate(channel))
+        return future
 
-    def disable_presence(self, private_key, channel, callback):
+    def disable_presence(self, private_key, channel, callback=None):
         '''Disables presence for the specified channel.
 
         **Note:** This method will send your Private Key over the Internet. Make sure to use secure connection.
 
         * *private_key* - The private key provided when the ORTC service is purchased.
         * *channel* - The channel name to disable presence.
-        * *callback* - The callback with error and result parameters.
+        * *callback* - The callback with error and result parameters, this parameter is optional.
+
+        Returns *Future* - Completes with the result, or fails with OrtcError.
 
         Usage:
 
@@ -671,130 +1290,207 @@ class OrtcClient(object):
         >>>         print str(result)
         >>> ortc_client.disable_presence('Your private key', 'blue', presence_callback)
         '''
-        is_ok, server = Private._prepare_server_internal(self.url, self.cluster_url, self.app_key, callback)
-        if is_ok:
-            disable_presence(server, False, self.app_key, private_key, channel, callback)
+        if self.app_key == None:
+            return Private._rest_error('Please, do connect first', callback)
+        self._presence_cache.invalidate(channel)
+        if self.cluster_url == None:
+            future = self._timed_rest(disable_presence(self.url, False, self.app_key, private_key, channel, callback))
+        else:
+            future = self._timed_rest(disable_presence(self.cluster_url, True, self.app_key, private_key, channel, callback))
+        future.add_done_callback(lambda f: self._presence_cache.invalidate(channel))
+        return future
+
+    def _timed_rest(self, future):
+        start = time.monotonic()
+        self._metrics.incr('rest_requests')
+        def done(f):
+            self._metrics.observe('rest', time.monotonic() - start)
+            if f.cancelled() or not f.exception() == None:
+                self._metrics.incr('rest_errors')
+        future.add_done_callback(done)
+        return future
 
     def _on_message(self, ws, message):
-        self.got_heartbeat = True
+        start = time.perf_counter()
+        now = time.monotonic()
+        metrics = self._metrics
+        if self._last_received:
+            metrics.observe('receive_gap', now - self._last_received)
+        self._last_received = now
+        metrics.incr('frames_received')
+        metrics.incr('bytes_received', len(message))
+        try:
+            self._handle_frame(message)
+        finally:
+            metrics.observe('receive', time.perf_counter() - start)
+
+    def _handle_frame(self, message):
         if message=='o':
-            self._ws.send(json.dumps('validate;'+self.app_key+';'+self.auth_token+';'+self.announcement_subchannel+';'+self.session_id+';'+self.connection_metadata+';'))
+            self._write(json.dumps('validate;'+self.app_key+';'+self.auth_token+';'+self.announcement_subchannel+';'+self.session_id+';'+self.connection_metadata+';'))
         elif message=='h':
              pass
         else:
             self._parse_message(message)
 
+    def _cancel_timers(self):
+        if not self._heartbeat_timer == None:
+            self._heartbeat_timer.cancel()
+            self._heartbeat_timer = None
+        if not self._reconnect_timer == None:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
 
     def _start_heartbeat_monitor(self):
-        self.monit_heartbeat = True
-        self.heartbeat_thread = threading.Thread(target=self._heartbeat_monitor)
-        self.heartbeat_thread.setDaemon(True)
-        self.heartbeat_thread.start()
-
-
-    def _heartbeat_monitor(self):
-        counter = 0
-        while self.monit_heartbeat:
-            time.sleep(1)
-            counter +=1
-            if self.got_heartbeat:
-                counter = 0
-                self.got_heartbeat = False
-            if counter > MAX_HEARTBEAT_INTERVAL:
-                self.monit_heartbeat = False
-                self._heartbeat_failed()
+        self._cancel_timers()
+        self._reconnect_attempts = 0
+        self._last_received = time.monotonic()
+        self._heartbeat_timer = self._scheduler.call_later(MAX_HEARTBEAT_INTERVAL, self._check_heartbeat, on_error=self._on_timer_error)
+
+    def _check_heartbeat(self):
+        if not self.is_connected:
+            return
+        idle = time.monotonic() - self._last_received
+        if idle < MAX_HEARTBEAT_INTERVAL:
+            self._heartbeat_timer = self._scheduler.call_later(MAX_HEARTBEAT_INTERVAL - idle, self._check_heartbeat, on_error=self._on_timer_error)
+        else:
+            self._heartbeat_timer = None
+            self._heartbeat_failed()
 
     def _heartbeat_failed(self):
+        # on the scheduler thread, shared by every client: closing the socket and the callback run on another thread
         self.keep_running = False
-        if not self._ws==None:
-            self._ws.close()
         self._state = states.RECONNECTING
-        for k in self._channels.keys():
+        self._metrics.incr('heartbeat_timeouts')
+        self._subscribe_times.clear()
+        self._cancel_resubscription()
+        for k in list(self._channels.keys()):
             self._channels[k].is_subscribing = False
             self._channels[k].is_subscribed = False
             if not self._channels[k].subscribe_on_reconnecting:
                 del self._channels[k]
-        if self.on_reconnecting_callback:
-            self.on_reconnecting_callback(self)
-        from threading import Thread
-        self.reconnecting_thread = Thread(target=self._reconnecting_loop)
-        self.reconnecting_thread.setDaemon(True)
-        self.reconnecting_thread.start()
-
-    def _reconnecting_loop(self):
-        counter = 1
-        while not self.is_connected and not self._state==states.DISCONNECTING:
-            if counter > RECONNECT_INTERVAL:
-                if not self._state == states.DISCONNECTING:
-                    self.connect(self.app_key, self.auth_token)
-                counter = 0
-            time.sleep(1)
-            counter += 1
+        t = threading.Thread(target=self._start_reconnecting, args=(self._ws,))
+        t.setDaemon(True)
+        t.start()
+
+    def _start_reconnecting(self, ws):
+        try:
+            if not ws == None:
+                ws.close()
+            if self.on_reconnecting_callback:
+                self.on_reconnecting_callback(self)
+        except Exception as e:
+            Private._call_exception_callback(self, str(e))
+        finally:
+            if self._state == states.RECONNECTING:
+                self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        delay = Private._reconnect_delay(self._reconnect_attempts, RECONNECT_INTERVAL, MAX_RECONNECT_INTERVAL)
+        self._reconnect_attempts += 1
+        self._reconnect_timer = self._scheduler.call_later(delay, self._reconnect, on_error=self._on_timer_error)
+
+    def _reconnect(self):
+        self._reconnect_timer = None
+        if not self._state == states.RECONNECTING:
+            return
+        t = threading.Thread(target=self._reconnect_attempt)
+        t.setDaemon(True)
+        t.start()
+
+    def _reconnect_attempt(self):
+        self._metrics.incr('reconnect_attempts')
+        try:
+            self.connect(self.app_key, self.auth_token)
+        except Exception as e:
+            Private._call_exception_callback(self, str(e))
+        if self._state == states.RECONNECTING:
+            self._schedule_reconnect()
 
     def _parse_message(self, message):
-        res = re.search(r'^a?\["\{\\"ch\\":\\"(.*)\\",\\"m\\":\\"([\s\S]*?)\\"\}"\]$', message)
-        rmg = res.groups() if not res == None else []
-        if not rmg == []:
-            channel =  rmg[0]
-            if not channel in self._channels: return
-            raw_message = rmg[1]
-            res = re.search(r'^(.[^_]*)_(.[^-]*)-(.[^_]*)_([\s\S]*?)$', raw_message)
-            if not res == None:
-                ret = res.groups()
-                message_id = ret[0]
-                message_count = int(ret[1])
-                message_total = int(ret[2])
-                message_part = ret[3]
-                if message_count==1 and message_total==1:
-                    self._channels[channel].callback(self, channel,  Private._remove_slashes(message_part))
-                else:
-                    if not message_id in self._messages_buffer:
-                        self._messages_buffer[message_id] = MultiMessage(message_total)
-                    self._messages_buffer[message_id].set_part(message_count-1, message_part)
-                    if self._messages_buffer[message_id].is_ready():
-                        all_message = self._messages_buffer[message_id].get_all_message()
-                        del self._messages_buffer[message_id]
-                        self._channels[channel].callback(self, channel, Private._remove_slashes(all_message))
+        start = time.perf_counter()
+        frames = self._decoder.decode(message)
+        self._metrics.observe('parse', time.perf_counter() - start)
+        for frame in frames:
+            if isinstance(frame, FrameOperation):
+                self._process_operation(frame.operation, frame.params)
             else:
-                self._channels[channel].callback(self, channel, Private._remove_slashes(raw_message))
-
-        res = re.search(r'^a\["\{\\"op\\":\\"([^"]+)\\",\\"(.*)\}"\]$', message)
-        ret = res.groups() if not res == None else []
-        if not ret == []: #operation
-            operation = ret[0]
-            params = ret[1]
-            if operation == 'ortc-validated':
-                pgrp = re.search(r'^up\\":{1}(.*),\\"set\\":(.*)', params).groups()
-                if pgrp[0] == 'null':
-                    self._permissions = {}
-                else:
-                    self._permissions = json.loads(pgrp[0].replace(r'\"', r'"'))
-                if self._state == states.RECONNECTING:
-                    self._state = states.CONNECTED
-                    for n in self._channels:
-                        ch = self._channels[n]
-                        self.subscribe(ch.name, True, ch.callback)
-                    if self.on_reconnected_callback:
-                        self.on_reconnected_callback(self)
-                else:
-                    self._state = states.CONNECTED
-                    if self.on_connected_callback:
-                        self.on_connected_callback(self)
-                self._start_heartbeat_monitor()
-            if operation == 'ortc-subscribed':
-                channel = re.search(r'^ch\\":\\"(.*)\\"$', params).groups()[0]
-                if channel in self._channels:
-                    self._channels[channel].is_subscribing = False
-                    self._channels[channel].is_subscribed = True
-                    if self.on_subscribed_callback:
-                        self.on_subscribed_callback(self, channel)
-            if operation == 'ortc-unsubscribed':
-                channel = re.search(r'^ch\\":\\"(.*)\\"$', params).groups()[0]
-                if channel in self._channels:
-                    del self._channels[channel]
-                    if self.on_unsubscribed_callback:
-                        self.on_unsubscribed_callback(self, channel)
-            if operation == 'ortc-error':
-                pgrp = re.search(r'ex\\":\\"(.*)\\"\}$', params).groups()
-                Private._call_exception_callback(self, pgrp[0])
-
+                self._process_channel_message(frame)
+
+    def _process_channel_message(self, frame):
+        channel = frame.channel
+        ch = self._channels.get(channel)
+        if ch == None: return
+        if isinstance(frame, FrameMessage):
+            message = frame.message
+        else:
+            message = self._messages_buffer.add_part(channel, frame.message_id, frame.part, frame.total_parts, frame.payload)
+            if message == None: return
+        self._metrics.incr('messages_received')
+        try:
+            message_id, message = self._compression.unwrap(frame.message_id, message, self._binary_messages)
+        except OrtcError as e:
+            Private._call_exception_callback(self, str(e))
+            return
+        if not self._tracer == None:
+            latency = self._tracer.received(channel, message_id)
+            if not latency == None:
+                self._metrics.observe('delivery', latency)
+        start = time.perf_counter()
+        try:
+            self._dispatcher.dispatch(channel, ch.callback, self, channel, message)
+        except OrtcError as e:
+            Private._call_exception_callback(self, str(e))
+        self._metrics.observe('dispatch', time.perf_counter() - start)
+
+    def _on_message_evicted(self, channel, message_id):
+        self._metrics.incr('messages_evicted')
+        if self.on_message_evicted_callback:
+            self.on_message_evicted_callback(self, channel, message_id)
+
+    def _process_operation(self, operation, params):
+        if operation == 'ortc-validated':
+            permissions = params.get('up')
+            self._permissions = PermissionIndex(permissions if isinstance(permissions, dict) else None)
+            if self._state == states.RECONNECTING:
+                self._state = states.CONNECTED
+                self._metrics.incr('reconnects')
+                if not self._resubscription == None:
+                    self._resubscription.cancel()
+                channels = [(ch.priority, ch.name) for ch in list(self._channels.values())]
+                self._resubscription = Resubscription(self._scheduler, channels, self._resubscribe, self._resubscribe_rate,
+                                                      RESUBSCRIBE_INTERVAL, self._on_resubscribe_progress, self._on_timer_error)
+                if self.on_reconnected_callback:
+                    self.on_reconnected_callback(self)
+            else:
+                self._state = states.CONNECTED
+                if self.on_connected_callback:
+                    self.on_connected_callback(self)
+            self._start_heartbeat_monitor()
+        elif operation == 'ortc-subscribed':
+            channel = params.get('ch')
+            if channel in self._channels:
+                self._channels[channel].is_subscribing = False
+                self._channels[channel].is_subscribed = True
+                if self.on_subscribed_callback:
+                    self.on_subscribed_callback(self, channel)
+            self._acks.settle(('subscribe', channel))
+            sent = self._subscribe_times.pop(channel, None)
+            if not sent == None:
+                self._metrics.incr('subscribe_acks')
+                self._metrics.observe('subscribe_ack', time.monotonic() - sent)
+            if not self._resubscription == None:
+                self._resubscription.confirmed(channel)
+        elif operation == 'ortc-unsubscribed':
+            channel = params.get('ch')
+            if channel in self._channels:
+                del self._channels[channel]
+                if self.on_unsubscribed_callback:
+                    self.on_unsubscribed_callback(self, channel)
+            self._acks.settle(('unsubscribe', channel))
+        elif operation == 'ortc-error':
+            ex = params.get('ex')
+            if isinstance(ex, dict):
+                if 'ch' in ex:
+                    self._acks.settle((ex.get('op'), ex.get('ch')), str(ex.get('ex')))
+                ex = ex.get('ex')
+            Private._call_exception_callback(self, str(ex))
@@ -0,0 +1,608 @@
+"""ORTC Python API for asyncio."""
+
+__author__      = "framework@realtime.co"
+__copyright__   = "Copyright 2015, Realtime "
+
+
+import asyncio
+import json
+import random
+import re
+import ssl
+import string
+from urllib.parse import urlparse
+from ortc_extensibility import *
+from ortc import states, MAX_CONNECTION_METADATA_SIZE, MAX_CHANNEL_NAME_SIZE, MAX_MESSAGE_SIZE, MAX_HEARTBEAT_INTERVAL, RECONNECT_INTERVAL, MAX_RECONNECT_INTERVAL, REST_TIMEOUT, MAX_BUFFERED_MESSAGES, MAX_BUFFERED_BYTES, MULTIPART_TTL
+
+_CLOSED = object()
+
+
+async def _http_request(method, url, body=None, headers=None):
+    uri = urlparse(url)
+    is_secure = uri.scheme == 'https'
+    port = uri.port or (443 if is_secure else 80)
+    path = (uri.path or '/') + ('?'+uri.query if uri.query else '')
+    async def request():
+        reader, writer = await asyncio.open_connection(uri.hostname, port, ssl=ssl.create_default_context() if is_secure else None)
+        try:
+            data = (body or '').encode()
+            lines = [method+' '+path+' HTTP/1.1', 'Host: '+uri.netloc, 'User-Agent: OrtcPythonApi', 'Connection: close', 'Content-Length: '+str(len(data))]
+            for k, v in (headers or {}).items():
+                lines.append(k+': '+str(v))
+            writer.write(('\r\n'.join(lines)+'\r\n\r\n').encode() + data)
+            response = await reader.read()
+        finally:
+            writer.close()
+        head, _, content = response.partition(b'\r\n\r\n')
+        head_lines = head.decode('latin-1').split('\r\n')
+        status = int(head_lines[0].split(' ')[1])
+        if 'transfer-encoding: chunked' in [l.lower() for l in head_lines[1:]]:
+            content = _decode_chunked(content)
+        return status, content
+    return await asyncio.wait_for(request(), REST_TIMEOUT)
+
+
+def _decode_chunked(content):
+    body = b''
+    while content:
+        size_line, _, content = content.partition(b'\r\n')
+        size = int(size_line.split(b';')[0], 16)
+        if size == 0:
+            break
+        body += content[:size]
+        content = content[size+2:]
+    return body
+
+
+async def _get_cluster(host, app_key):
+    found, server, refresh = cluster_cache.peek(host, app_key)
+    if refresh:
+        asyncio.get_running_loop().create_task(_warm_up_cluster(host, app_key))
+    if found:
+        return server
+    return await _warm_up_cluster(host, app_key)
+
+
+async def _warm_up_cluster(host, app_key):
+    server = await _fetch_cluster(host, app_key)
+    cluster_cache.put(host, app_key, server)
+    return server
+
+
+async def _fetch_cluster(host, app_key):
+    try:
+        status, content = await _http_request('GET', host+'?appkey='+app_key)
+        if status == 200:
+            return re.search('"(.*)"', content.decode()).group(0)[1:-1]
+    except Exception:
+        return None
+
+
+async def _prepare_server(url, is_cluster, app_key):
+    server = await _get_cluster(url, app_key) if is_cluster else url
+    if server == None:
+        raise OrtcError('Error getting server from Cluster')
+    return server if server[-1] == '/' else server+'/'
+
+
+async def save_authentication(url, is_cluster, authentication_token, is_private, application_key, time_to_live, private_key, channels_permissions):
+    '''Saves the channel and its permissions for the supplied application key and authentication token.
+
+    Same parameters as ortc.save_authentication.
+
+    Returns boolean- Indicates whether the authentication was successful.
+
+    Usage:
+
+    >>> r = await ortc_async.save_authentication('https://ortc-developers.realtime.co/server/ssl/2.1', True, 'Your authentication token', False, 'Your application key', 1800, 'Your private key', {'blue': 'r'})
+    '''
+    post_str = Private._authentication_body(authentication_token, is_private, application_key, time_to_live, private_key, channels_permissions)
+    server = await _prepare_server(url, is_cluster, application_key)
+    status, content = await _http_request('POST', server+'authenticate', post_str, {'Content-Type': 'application/x-www-form-urlencoded'})
+    return status == 201
+
+
+async def presence(url, is_cluster, application_key, authentication_token, channel):
+    '''Gets a dictionary indicating the subscriptions number in the specified channel and if active the first 100 unique metadata.
+
+    Same parameters as ortc.presence, without the callback. Raises OrtcError on failure.
+
+    Usage:
+
+    >>> result = await ortc_async.presence('http://ortc-developers.realtime.co/server/2.1', True, 'Your application key', 'Your authentication token', 'blue')
+    '''
+    server = await _prepare_server(url, is_cluster, application_key)
+    status, content = await _http_request('GET', server+'presence/'+application_key+'/'+authentication_token+'/'+channel)
+    if not status == 200:
+        raise OrtcError(str(status))
+    return json.loads(content)
+
+
+async def enable_presence(url, is_cluster, application_key, private_key, channel, metadata):
+    '''Enables presence for the specified channel with first 100 unique metadata if true.
+
+    Same parameters as ortc.enable_presence, without the callback. Raises OrtcError on failure.
+
+    Usage:
+
+    >>> result = await ortc_async.enable_presence('http://ortc-developers.realtime.co/server/2.1', True, 'Your application key', 'Your private key', 'blue', True)
+    '''
+    server = await _prepare_server(url, is_cluster, application_key)
+    content = 'privatekey='+private_key+ ('&metadata=1' if metadata else '&metadata=0')
+    return await _rest_post(server+'presence/enable/'+application_key+'/'+channel, content)
+
+
+async def disable_presence(url, is_cluster, application_key, private_key, channel):
+    '''Disables presence for the specified channel.
+
+    Same parameters as ortc.disable_presence, without the callback. Raises OrtcError on failure.
+
+    Usage:
+
+    >>> result = await ortc_async.disable_presence('http://ortc-developers.realtime.co/server/2.1', True, 'Your application key', 'Your private key', 'blue')
+    '''
+    server = await _prepare_server(url, is_cluster, application_key)
+    return await _rest_post(server+'presence/disable/'+application_key+'/'+channel, 'privatekey='+private_key)
+
+
+async def _rest_post(url, body):
+    status, content = await _http_request('POST', url, body)
+    if not status == 200:
+        raise OrtcError(str(status))
+    return content.decode()
+
+
+class AsyncOrtcClient(object):
+    """A class representing an ORTC Client running on an asyncio event loop.
+
+    It mirrors OrtcClient, but its operations are coroutines that raise
+    OrtcError instead of calling the exception callback, and messages can be
+    consumed either through a callback or with *messages(channel)*. Messages
+    compressed by an OrtcClient are decompressed after reassembly, and
+    messages sent as bytes are received as bytes when *binary_messages* is set.
+
+    Requires the websockets module.
+    """
+
+    def __init__(self):
+        self.app_key = None
+        self.auth_token = None
+        self.announcement_subchannel = ''
+        self.connection_metadata = ''
+        self.binary_messages = False
+        self.url = None
+        self.cluster_url = None
+        self.on_exception_callback = None
+        self.on_connected_callback = None
+        self.on_disconnected_callback = None
+        self.on_reconnecting_callback = None
+        self.on_reconnected_callback = None
+        self.on_subscribed_callback = None
+        self.on_unsubscribed_callback = None
+        self._state = states.DISCONNECTED
+        self._session_id = None
+        self._permissions = PermissionIndex()
+        self._channels = {}
+        self._queues = {}
+        self._acks = {}
+        self._ws = None
+        self._validated = None
+        self._task = None
+        self._reconnect_attempts = 0
+        self._decoder = FrameDecoder()
+        self._encoder = None
+        self._messages_buffer = MessageBuffer(MAX_BUFFERED_MESSAGES, MAX_BUFFERED_BYTES, MULTIPART_TTL)
+        self._codec = PayloadCodec()
+
+    @property
+    def is_connected(self):
+        '''Indicates whether the client is connected (read only)'''
+        return self._state == states.CONNECTED
+
+    @property
+    def session_id(self):
+        '''The client session identifier (read only)'''
+        return self._session_id
+
+    async def connect(self, application_key, authentication_token='PM.Anonymous'):
+        '''Connects the client using the supplied application key and authentication token, and waits until it is validated.
+
+        * *application_key* - Your ORTC application key.
+        * *authentication_token* - Your ORTC authentication token, this parameter is optional.
+
+        Usage:
+
+        >>> ortc_client = ortc_async.AsyncOrtcClient()
+        >>> ortc_client.cluster_url = 'https://ortc-developers.realtime.co/server/ssl/2.1'
+        >>> await ortc_client.connect('Your application key', 'Your authentication token')
+        '''
+        if self.is_connected:
+            raise OrtcError('Already connected')
+        elif self._state == states.CONNECTING:
+            raise OrtcError('Already trying to connect')
+        elif not isinstance(application_key, str) or len(application_key)<1:
+            raise OrtcError('Wrong Application Key')
+        elif self.url == None and self.cluster_url == None:
+            raise OrtcError('URL and Cluster URL are null or empty')
+        elif not self.url == None and not Private._validate_url(self.url):
+            raise OrtcError('Invalid URL')
+        elif not self.cluster_url == None and not Private._validate_url(self.cluster_url):
+            raise OrtcError('Invalid Cluster URL')
+        elif not Private._validate_input(application_key):
+            raise OrtcError('Application Key has invalid characters')
+        elif not Private._validate_input(authentication_token):
+            raise OrtcError('Authentication Token has invalid characters')
+        elif not Private._validate_input(self.announcement_subchannel):
+            raise OrtcError('Announcement Subchannel has invalid characters')
+        elif len(self.connection_metadata) > MAX_CONNECTION_METADATA_SIZE:
+            raise OrtcError('Metadata exceeds the limit of '+ str(MAX_CONNECTION_METADATA_SIZE) + ' bytes')
+        self.app_key = application_key
+        self.auth_token = authentication_token
+        self._state = states.CONNECTING
+        try:
+            await self._open()
+        except Exception:
+            self._state = states.DISCONNECTED
+            raise
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            await asyncio.wait_for(asyncio.shield(self._validated), MAX_HEARTBEAT_INTERVAL)
+        except asyncio.TimeoutError:
+            await self._close()
+            raise OrtcError('Connection was not validated by the server')
+        except OrtcError:
+            await self._close()
+            raise
+
+    async def disconnect(self):
+        '''Disconnects the client.
+
+        Usage:
+
+        >>> await ortc_client.disconnect()
+        '''
+        if not self.is_connected and not self._state == states.RECONNECTING:
+            raise OrtcError('Not connected')
+        await self._close()
+        if self.on_disconnected_callback:
+            self.on_disconnected_callback(self)
+
+    def is_subscribed(self, channel):
+        '''Indicates whether the client is subscribed to the supplied channel.'''
+        return channel in self._channels and self._channels[channel].is_subscribed
+
+    async def subscribe(self, channel, subscribe_on_reconnect, on_message=None, timeout=None):
+        '''Subscribes to the supplied channel and waits for the server to confirm it.
+
+        * *channel* - The channel name.
+        * *subscribe_on_reconnect* - Indicates whether the client should subscribe to the channel when reconnected.
+        * *on_message* - The callback, or coroutine function, called when a message arrives at the channel. When omitted the messages are read with messages(channel).
+        * *timeout* - The maximum time to wait for the confirmation, in seconds. The channel is forgotten when it expires.
+
+        Usage:
+
+        >>> await ortc_client.subscribe('blue', True)
+        >>> async for message in ortc_client.messages('blue'):
+        >>>     print(message)
+        '''
+        self._check_channel(channel)
+        if channel in self._channels and self._channels[channel].is_subscribed:
+            raise OrtcError('Already subscribing to the channel \''+channel+'\'')
+        if not on_message == None and not hasattr(on_message, '__call__'):
+            raise OrtcError('The argument \'onMessageCallback\' must be a function')
+        has_permission, phash = Private._check_permission(self._permissions, channel)
+        if not has_permission:
+            raise OrtcError('No permissions found to subscribe channel: '+channel)
+        if on_message == None:
+            queue = self._queues.setdefault(channel, asyncio.Queue())
+            on_message = lambda sender, ch, message: queue.put_nowait(message)
+        ch = Channel(channel, subscribe_on_reconnect, on_message)
+        ch.is_subscribing = True
+        self._channels[channel] = ch
+        ack = self._acks[channel] = asyncio.get_running_loop().create_future()
+        try:
+            await self._ws.send(json.dumps('subscribe;'+self.app_key+';'+self.auth_token+';'+channel+';'+phash))
+            await asyncio.wait_for(asyncio.shield(ack), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # the caller is told the subscription failed, so it must not be restored on reconnect either
+            if self._acks.get(channel) is ack:
+                del self._acks[channel]
+            if self._channels.get(channel) is ch and not ch.is_subscribed:
+                del self._channels[channel]
+                queue = self._queues.pop(channel, None)
+                if not queue == None:
+                    queue.put_nowait(_CLOSED)
+            raise
+
+    async def unsubscribe(self, channel):
+        '''Unsubscribes from the supplied channel to stop receiving messages sent to it.
+
+        Usage:
+
+        >>> await ortc_client.unsubscribe('blue')
+        '''
+        self._check_channel(channel)
+        if not channel in self._channels:
+            raise OrtcError('Not subscribed to the channel \''+channel+'\'')
+        self._channels[channel].subscribe_on_reconnecting = False
+        await self._ws.send(json.dumps('unsubscribe;'+self.app_key+';'+channel))
+
+    async def send(self, channel, message):
+        '''Sends the supplied message, a string or a bytes-like object, to the supplied channel.
+
+        Usage:
+
+        >>> await ortc_client.send('blue', 'This is a message')
+        >>> await ortc_client.send('blue', protobuf_message.SerializeToString())
+        '''
+        self._check_channel(channel)
+        if not isinstance(message, (str, bytes, bytearray, memoryview)) or len(message)<1:
+            raise OrtcError('Message is null or empty or not a string or bytes')
+        has_permission, phash = Private._check_permission(self._permissions, channel)
+        if not has_permission:
+            raise OrtcError('No permissions found to send to channel: '+channel)
+        message_id = ''.join(random.choice(string.ascii_letters + string.digits) for x in range(8))
+        if not isinstance(message, str):
+            try:
+                prefix, message = self._codec.encode(message)
+            except (TypeError, ValueError) as e:
+                raise OrtcError('Unable to encode the message: ' + str(e))
+            message_id = prefix + message_id
+        frames = self._encoder.send_frames(channel, phash, message_id, message)
+        await self._ws.send(frames[0] if len(frames) == 1 else FrameEncoder.batch(frames))
+
+    async def messages(self, channel):
+        '''Iterates over the messages received on a channel subscribed without a callback, until it is unsubscribed.
+
+        Usage:
+
+        >>> async for message in ortc_client.messages('blue'):
+        >>>     print(message)
+        '''
+        queue = self._queues.setdefault(channel, asyncio.Queue())
+        while True:
+            message = await queue.get()
+            if message is _CLOSED:
+                return
+            yield message
+
+    async def presence(self, channel):
+        '''Gets a dictionary indicating the subscriptions number in the specified channel and if active the first 100 unique metadata.
+
+        Usage:
+
+        >>> result = await ortc_client.presence('blue')
+        '''
+        return await presence(await self._server(), False, self.app_key, self.auth_token, channel)
+
+    async def enable_presence(self, private_key, channel, metadata):
+        '''Enables presence for the specified channel with first 100 unique metadata if true.
+
+        Usage:
+
+        >>> await ortc_client.enable_presence('Your private key', 'blue', True)
+        '''
+        return await enable_presence(await self._server(), False, self.app_key, private_key, channel, metadata)
+
+    async def disable_presence(self, private_key, channel):
+        '''Disables presence for the specified channel.
+
+        Usage:
+
+        >>> await ortc_client.disable_presence('Your private key', 'blue')
+        '''
+        return await disable_presence(await self._server(), False, self.app_key, private_key, channel)
+
+    async def save_authentication(self, authentication_token, is_private, time_to_live, private_key, channels_permissions):
+        '''Saves the channel permissions of an authentication token on the server the client uses.
+
+        Usage:
+
+        >>> await ortc_client.save_authentication('Some token', False, 1800, 'Your private key', {'blue': 'r'})
+        '''
+        return await save_authentication(await self._server(), False, authentication_token, is_private, self.app_key, time_to_live, private_key, channels_permissions)
+
+    def _check_channel(self, channel):
+        if not self.is_connected:
+            raise OrtcError('Not connected')
+        channel_error = Private._channel_error(channel, MAX_CHANNEL_NAME_SIZE)
+        if channel_error:
+            raise OrtcError(channel_error)
+
+    async def _server(self):
+        if self.app_key == None:
+            raise OrtcError('Please, do connect first')
+        if self.cluster_url == None:
+            return self.url
+        server = await _get_cluster(self.cluster_url, self.app_key)
+        if server == None:
+            raise OrtcError('Error getting server from Cluster')
+        return server
+
+    async def _open(self):
+        import websockets
+        server = await _get_cluster(self.cluster_url, self.app_key) if not self.cluster_url == None else self.url
+        if server == None:
+            raise OrtcError('Host is not reachable')
+        rand_str = ''.join(random.choice(string.ascii_letters + string.digits) for x in range(8))
+        self._session_id = ''.join(random.choice(string.ascii_letters + string.digits) for x in range(16))
+        ws_url = 'ws'+server[4:]+'/broadcast/'+str(random.randint(0,1000))+'/'+rand_str+'/websocket'
+        self._encoder = FrameEncoder(self.app_key, self.auth_token, MAX_MESSAGE_SIZE)
+        self._validated = asyncio.get_running_loop().create_future()
+        try:
+            self._ws = await websockets.connect(ws_url, ping_interval=None)
+        except Exception:
+            if not self.cluster_url == None:
+                cluster_cache.invalidate(self.cluster_url, self.app_key)
+            raise
+
+    async def _close(self):
+        self._state = states.DISCONNECTING
+        if not self._task == None and not self._task is asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+        if not self._ws == None:
+            await self._ws.close()
+        self._channels.clear()
+        self._fail_acks(OrtcError('Disconnected'))
+        for queue in self._queues.values():
+            queue.put_nowait(_CLOSED)
+        self._queues.clear()
+        self._state = states.DISCONNECTED
+
+    async def _run(self):
+        while True:
+            try:
+                message = await asyncio.wait_for(self._ws.recv(), MAX_HEARTBEAT_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if self._state in (states.DISCONNECTING, states.DISCONNECTED):
+                    return
+                await self._reconnect()
+                continue
+            self._on_message(message)
+
+    async def _reconnect(self):
+        self._state = states.RECONNECTING
+        try:
+            await self._ws.close()
+        except Exception:
+            pass
+        for name in list(self._channels):
+            ch = self._channels[name]
+            ch.is_subscribing = False
+            ch.is_subscribed = False
+            if not ch.subscribe_on_reconnecting:
+                del self._channels[name]
+        self._fail_acks(OrtcError('Reconnecting'))
+        if self.on_reconnecting_callback:
+            self.on_reconnecting_callback(self)
+        while self._state == states.RECONNECTING:
+            await asyncio.sleep(Private._reconnect_delay(self._reconnect_attempts, RECONNECT_INTERVAL, MAX_RECONNECT_INTERVAL))
+            self._reconnect_attempts += 1
+            try:
+                await self._open()
+                return
+            except Exception:
+                pass
+
+    def _fail_acks(self, error):
+        for ack in self._acks.values():
+            if not ack.done():
+                ack.set_exception(error)
+                ack.exception()
+        self._acks.clear()
+
+    def _on_message(self, message):
+        if message == 'o':
+            asyncio.get_running_loop().create_task(self._ws.send(json.dumps('validate;'+self.app_key+';'+self.auth_token+';'+self.announcement_subchannel+';'+self.session_id+';'+self.connection_metadata+';')))
+        elif message == 'c' or message.startswith('c['):
+            asyncio.get_running_loop().create_task(self._ws.close())
+        else:
+            for frame in self._decoder.decode(message):
+                # a failing callback is reported and must not end the receive task
+                try:
+                    if isinstance(frame, FrameOperation):
+                        self._process_operation(frame.operation, frame.params)
+                    else:
+                        self._process_channel_message(frame)
+                except Exception as e:
+                    Private._call_exception_callback(self, str(e))
+
+    def _process_channel_message(self, frame):
+        channel = frame.channel
+        ch = self._channels.get(channel)
+        if ch == None: return
+        if isinstance(frame, FrameMessage):
+            message = frame.message
+        else:
+            message = self._messages_buffer.add_part(channel, frame.message_id, frame.part, frame.total_parts, frame.payload)
+            if message == None: return
+        try:
+            message_id, message = self._codec.unwrap(frame.message_id, message, self.binary_messages)
+        except OrtcError as e:
+            Private._call_exception_callback(self, str(e))
+            return
+        r = ch.callback(self, channel, message)
+        if asyncio.iscoroutine(r):
+            asyncio.get_running_loop().create_task(r).add_done_callback(self._on_callback_done)
+
+    def _on_callback_done(self, task):
+        if not task.cancelled() and not task.exception() == None:
+            Private._call_exception_callback(self, str(task.exception()))
+
+    def _process_operation(self, operation, params):
+        if operation == 'ortc-validated':
+            permissions = params.get('up')
+            self._permissions = PermissionIndex(permissions if isinstance(permissions, dict) else None)
+            reconnected = self._state == states.RECONNECTING
+            self._state = states.CONNECTED
+            self._reconnect_attempts = 0
+            if not self._validated.done():
+                self._validated.set_result(True)
+            if reconnected:
+                for ch in list(self._channels.values()):
+                    has_permission, phash = Private._check_permission(self._permissions, ch.name)
+                    if has_permission:
+                        ch.is_subscribing = True
+                        asyncio.get_running_loop().create_task(self._ws.send(json.dumps('subscribe;'+self.app_key+';'+self.auth_token+';'+ch.name+';'+phash)))
+                if self.on_reconnected_callback:
+                    self.on_reconnected_callback(self)
+            elif self.on_connected_callback:
+                self.on_connected_callback(self)
+        elif operation == 'ortc-subscribed':
+            channel = params.get('ch')
+            if channel in self._channels:
+                self._channels[channel].is_subscribing = False
+                self._channels[channel].is_subscribed = True
+                ack = self._acks.pop(channel, None)
+                if not ack == None and not ack.done():
+                    ack.set_result(True)
+                if self.on_subscribed_callback:
+                    self.on_subscribed_callback(self, channel)
+        elif operation == 'ortc-unsubscribed':
+            channel = params.get('ch')
+            if channel in self._channels:
+                del self._channels[channel]
+                queue = self._queues.pop(channel, None)
+                if not queue == None:
+                    queue.put_nowait(_CLOSED)
+                if self.on_unsubscribed_callback:
+                    self.on_unsubscribed_callback(self, channel)
+        elif operation == 'ortc-error':
+            ex = params.get('ex')
+            if isinstance(ex, dict):
+                ex = ex.get('ex')
+            if self._state == states.CONNECTING and not self._validated.done():
+                self._validated.set_exception(OrtcError(str(ex)))
+            elif self.on_exception_callback:
+                self.on_exception_callback(self, str(ex))
+
+    def set_on_exception_callback(self, callback):
+        '''Sets the callback which occurs when the server reports an error.'''
+        self.on_exception_callback = callback
+
+    def set_on_connected_callback(self, callback):
+        '''Sets the callback which occurs when the client connects.'''
+        self.on_connected_callback = callback
+
+    def set_on_disconnected_callback(self, callback):
+        '''Sets the callback which occurs when the client disconnects.'''
+        self.on_disconnected_callback = callback
+
+    def set_on_reconnected_callback(self, callback):
+        '''Sets the callback which occurs when the client reconnects.'''
+        self.on_reconnected_callback = callback
+
+    def set_on_reconnecting_callback(self, callback):
+        '''Sets the callback which occurs when the client attempts to reconnect.'''
+        self.on_reconnecting_callback = callback
+
+    def set_on_subscribed_callback(self, callback):
+        '''Sets the callback which occurs when the client subscribes to a channel.'''
+        self.on_subscribed_callback = callback
+
+    def set_on_unsubscribed_callback(self, callback):
+        '''Sets the callback which occurs when the client unsubscribes from a channel.'''
+        self.on_unsubscribed_callback = callback
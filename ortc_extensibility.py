@@ -1,13 +1,31 @@
+import bisect
+import collections
+import heapq
 import http.client
 import re
 import random
+import socket
 import string
 import time
+import traceback
 import websocket
 import json
 import threading
+import zlib
+from base64 import b64encode, b64decode
+from json.encoder import encode_basestring_ascii as _encode_string
 
 REST_TIMEOUT = 5
+REST_WORKERS = 16
+CLUSTER_CACHE_TTL = 300
+CLUSTER_CACHE_STALE_TTL = 3600
+CLUSTER_CACHE_NEGATIVE_TTL = 5
+
+_permission_channel_re = re.compile(r'^[\w\-:\/.]+$')
+_input_re = re.compile(r'^[\w\-:\/\.]*$')
+_url_re = re.compile(r'^\s*(http|https):\/\/(\w+:{0,1}\w*@)?(\S+)(:[0-9]+)?(\/|\/([\w#!:.?+=&%@!\-\/]))?\s*$')
+_valid_channels = set()
+MAX_VALID_CHANNELS = 4096
 
 class OrtcError(Exception):
     def __init__(self, message):
@@ -16,109 +34,461 @@ class OrtcError(Exception):
         return self.message
 
 class Channel(object):
-    @property
-    def name(self):
-        return self._name
-    @name.setter
-    def name(self, name):
-        self._name = name
+    __slots__ = ('name', 'subscribe_on_reconnecting', 'is_subscribing', 'is_subscribed', 'callback', 'priority')
 
-    @property
-    def subscribe_on_reconnecting(self):
-        return self._subscribe_on_reconnecting
-    @subscribe_on_reconnecting.setter
-    def subscribe_on_reconnecting(self, subscribe_on_reconnecting):
-        self._subscribe_on_reconnecting = subscribe_on_reconnecting
-
-    @property
-    def is_subscribing(self):
-        return self._is_subscribing
-    @is_subscribing.setter
-    def is_subscribing(self, is_subscribing):
-        self._is_subscribing = is_subscribing
-
-    @property
-    def is_subscribed(self):
-        return self._is_subscribed
-    @is_subscribed.setter
-    def is_subscribed(self, is_subscribed):
-        self._is_subscribed = is_subscribed
-
-    @property
-    def callback(self):
-        return self._callback
-    @callback.setter
-    def callback(self, callback):
-        self._callback = callback
-
-    def __init__(self, name, subscribe_on_reconnecting, callback):
-        self._name = name
-        self._subscribe_on_reconnecting = subscribe_on_reconnecting
-        self._is_subscribing = False
-        self._is_subscribed = False
-        self._callback = callback
+    def __init__(self, name, subscribe_on_reconnecting, callback, priority=None):
+        self.name = name
+        self.subscribe_on_reconnecting = subscribe_on_reconnecting
+        self.is_subscribing = False
+        self.is_subscribed = False
+        self.callback = callback
+        self.priority = priorities.NORMAL if priority == None else priority
 
 
 class MultiMessage(object):
-    @property
-    def total_parts(self):
-        return self._total_parts
-    @total_parts.setter
-    def total_parts(self, total_parts):
-        self._total_parts = total_parts
-
-    @property
-    def ready_parts(self):
-        return self._ready_parts
-    @ready_parts.setter
-    def ready_parts(self, ready_parts):
-        self._ready_parts = ready_parts
+    __slots__ = ('total_parts', 'ready_parts', 'size', '_parts')
 
     def __init__(self, total_parts):
-        self._total_parts = total_parts
-        self._ready_parts = 0
-        self._parts = [None]*total_parts
+        self.total_parts = total_parts
+        self.ready_parts = 0
+        self.size = 0
+        self._parts = {}
 
     def set_part(self, part_id, part):
-        if self._parts[part_id] == None:
-            self._ready_parts += 1
+        old = self._parts.get(part_id)
+        if old == None:
+            self.ready_parts += 1
+        else:
+            self.size -= len(old)
         self._parts[part_id] = part
+        self.size += len(part)
 
     def is_ready(self):
-        return True if self._ready_parts == self._total_parts else False
+        return True if self.ready_parts == self.total_parts else False
 
     def get_all_message(self):
-        return ''.join([str(x) for x in self._parts])
+        parts = self._parts
+        return ''.join([parts[i] for i in range(self.total_parts)])
+
+
+class MessageBuffer(object):
+    '''Reassembles multipart messages within a bounded memory budget.
+
+    At most *max_messages* incomplete messages holding *max_bytes* characters
+    of parts are kept. The least recently updated message is evicted when a
+    limit is exceeded, a message with no new part for *ttl* seconds
+    expires, and a message is replaced when a part of the same id announces
+    a different number of parts. Each eviction increments *evicted* and calls
+    *on_evicted(channel, message_id)*.
+    '''
+
+    def __init__(self, max_messages, max_bytes, ttl, on_evicted=None):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evicted = on_evicted
+        self.evicted = 0
+        self._bytes = 0
+        self._messages = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._messages)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def add_part(self, channel, message_id, part, total_parts, payload):
+        '''Stores a part (1-based) and returns the whole message once all its parts arrived.'''
+        now = time.monotonic()
+        self._expire(now)
+        if part < 1 or part > total_parts:
+            return None
+        key = (channel, message_id)
+        entry = self._messages.get(key)
+        if entry == None or not entry[0].total_parts == total_parts:
+            if not entry == None:
+                self._evict(key)
+            entry = [MultiMessage(total_parts), now]
+            self._messages[key] = entry
+        else:
+            entry[1] = now
+            self._messages.move_to_end(key)
+        multi_message = entry[0]
+        size = multi_message.size
+        multi_message.set_part(part-1, payload)
+        self._bytes += multi_message.size - size
+        if multi_message.is_ready():
+            self._remove(key)
+            return multi_message.get_all_message()
+        while len(self._messages) > self.max_messages or self._bytes > self.max_bytes:
+            self._evict(next(iter(self._messages)))
+        return None
+
+    def clear(self):
+        self._messages.clear()
+        self._bytes = 0
+
+    def _expire(self, now):
+        while self._messages:
+            key, entry = next(iter(self._messages.items()))
+            if now - entry[1] < self.ttl:
+                break
+            self._evict(key)
+
+    def _evict(self, key):
+        self._remove(key)
+        self.evicted += 1
+        if self.on_evicted:
+            self.on_evicted(key[0], key[1])
+
+    def _remove(self, key):
+        entry = self._messages.pop(key)
+        self._bytes -= entry[0].size
+
+
+class FrameMessage(object):
+    '''A complete message received on a channel, and its message id when it has one.'''
+    def __init__(self, channel, message, message_id=None):
+        self.channel = channel
+        self.message = message
+        self.message_id = message_id
+
+
+class FrameFragment(object):
+    '''One part of a multipart message received on a channel.'''
+    def __init__(self, channel, message_id, part, total_parts, payload):
+        self.channel = channel
+        self.message_id = message_id
+        self.part = part
+        self.total_parts = total_parts
+        self.payload = payload
+
+
+class FrameOperation(object):
+    '''A server operation (ortc-validated, ortc-subscribed, ...) and its parameters.'''
+    def __init__(self, operation, params):
+        self.operation = operation
+        self.params = params
+
+
+class FrameDecoder(object):
+    '''Decodes the SockJS "a[...]" frames sent by the ORTC server.
+
+    The frame is classified once and its payload is unescaped by a single
+    JSON decode. Every element of a batched frame is decoded, in order, into a
+    FrameMessage, a FrameFragment or a FrameOperation.
+
+    *frames* and *elements* count the decoded frames and the elements they
+    carried, so *elements*/*frames* is the server batching factor.
+    '''
+
+    def __init__(self):
+        self.frames = 0
+        self.elements = 0
+        self.max_elements = 0
+
+    def decode(self, frame):
+        if not frame.startswith('a['):
+            return []
+        try:
+            elements = json.loads(frame[1:])
+        except (ValueError, TypeError):
+            return []
+        if not isinstance(elements, list):
+            return []
+        count = len(elements)
+        self.frames += 1
+        self.elements += count
+        if count > self.max_elements:
+            self.max_elements = count
+        decoded = []
+        for element in elements:
+            item = self.decode_element(element)
+            if not item == None:
+                decoded.append(item)
+        return decoded
+
+    def decode_element(self, element):
+        try:
+            data = json.loads(element)
+        except (ValueError, TypeError):
+            return None
+        if not isinstance(data, dict):
+            return None
+        if 'op' in data:
+            operation = data.pop('op')
+            return FrameOperation(operation, data)
+        if 'ch' in data and 'm' in data:
+            return self._decode_channel_message(data['ch'], data['m'])
+        return None
+
+    @staticmethod
+    def _decode_channel_message(channel, raw):
+        # raw is "<message_id>_<part>-<total>_<payload>" or a plain message
+        i = raw.find('_', 1)
+        j = raw.find('-', i + 2) if i > 0 else -1
+        k = raw.find('_', j + 2) if j > 0 else -1
+        if k < 0:
+            return FrameMessage(channel, raw)
+        try:
+            part = int(raw[i+1:j])
+            total = int(raw[j+1:k])
+        except ValueError:
+            return FrameMessage(channel, raw)
+        if part == 1 and total == 1:
+            return FrameMessage(channel, raw[k+1:], raw[:i])
+        return FrameFragment(channel, raw[:i], part, total, raw[k+1:])
+
+
+class FrameEncoder(object):
+    '''Encodes the send frames of a connection.
+
+    The JSON-escaped "send;app_key;auth_token;channel;hash;" prefix is built
+    once per channel and cached, so every part only escapes its own slice of
+    the message.
+    '''
+
+    MAX_CACHED_PREFIXES = 4096
+
+    def __init__(self, app_key, auth_token, part_size):
+        self.app_key = app_key
+        self.auth_token = auth_token
+        self.part_size = part_size
+        self._prefixes = {}
+
+    def send_prefix(self, channel, phash):
+        cached = self._prefixes.get(channel)
+        if not cached == None and cached[0] == phash:
+            return cached[1]
+        if len(self._prefixes) >= self.MAX_CACHED_PREFIXES:
+            self._prefixes.clear()
+        prefix = _encode_string('send;'+self.app_key+';'+self.auth_token+';'+channel+';'+phash+';')[:-1]
+        self._prefixes[channel] = (phash, prefix)
+        return prefix
+
+    def send_frames(self, channel, phash, message_id, message):
+        '''Returns the JSON frames carrying *message* split in parts of at most part_size characters.'''
+        prefix = self.send_prefix(channel, phash)
+        size = self.part_size
+        total = (len(message) + size - 1) // size
+        frames = [None]*total
+        for i in range(total):
+            frames[i] = '%s%s_%d-%d_%s' % (prefix, message_id, i+1, total, _encode_string(message[i*size:(i+1)*size])[1:])
+        return frames
+
+    @staticmethod
+    def batch(frames):
+        '''Joins frames into one SockJS message array, written to the socket at once.'''
+        return '[' + ','.join(frames) + ']'
+
+
+class PermissionIndex(object):
+    '''The channel permissions of a connection, compiled once when it is validated.
+
+    Exact channel names and "prefix:*" wildcards are kept in separate maps,
+    and every channel checked is remembered, so repeated checks cost a single
+    dictionary lookup.
+    '''
+
+    MAX_CACHED_CHANNELS = 4096
+
+    def __init__(self, permissions=None):
+        self._exact = dict(permissions) if permissions else {}
+        self._wildcards = {}
+        for k, v in self._exact.items():
+            if k.endswith(':*'):
+                self._wildcards[k[:-2]] = v
+        self._checked = {}
+
+    def __len__(self):
+        return len(self._exact)
+
+    def check(self, channel):
+        '''Returns (has_permission, hash) for *channel*.'''
+        if not self._exact:
+            return True, ''
+        result = self._checked.get(channel)
+        if not result == None:
+            return result
+        phash = self._exact.get(channel)
+        if phash == None:
+            i = channel.find(':')
+            if i >= 0:
+                phash = self._wildcards.get(channel[:i])
+        result = (False, '') if phash == None else (True, phash)
+        if len(self._checked) >= self.MAX_CACHED_CHANNELS:
+            self._checked.clear()
+        self._checked[channel] = result
+        return result
+
+
+class HTTPConnectionPool(object):
+    '''Keeps the HTTP and HTTPS connections of the REST requests open for reuse, per host.
+
+    At most *max_connections* requests run at once against a host and at most
+    *max_idle* connections are kept open for it. An idle connection older than
+    *idle_timeout* seconds is closed instead of reused, and a request that
+    fails on a reused connection is retried once on a new one. With
+    *follow_scheme* every request follows the scheme of its URL, for servers
+    that only speak HTTP such as a local ortc_server.OrtcServer.
+    '''
+
+    def __init__(self, max_idle=4, max_connections=16, idle_timeout=30, timeout=REST_TIMEOUT, follow_scheme=False):
+        self.max_idle = max_idle
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.follow_scheme = follow_scheme
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, body=None, headers=None, secure=None):
+        '''Sends a request and returns (status, body).
+
+        *secure* forces HTTPS on or off instead of following the URL scheme, unless *follow_scheme* is set.
+        '''
+        from urllib.parse import urlparse
+        uri = urlparse(url)
+        if secure == None or self.follow_scheme:
+            secure = uri.scheme == 'https'
+        key = (secure, uri.netloc)
+        path = (uri.path or '/') + ('?'+uri.query if uri.query else '')
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot == None:
+                slot = self._slots[key] = threading.BoundedSemaphore(self.max_connections)
+        if not slot.acquire(timeout=self.timeout):
+            raise OrtcError('Too many concurrent requests to '+uri.netloc)
+        try:
+            while True:
+                conn, reused = self._get(key)
+                try:
+                    conn.request(method, path, body, headers or {})
+                    res = conn.getresponse()
+                    data = res.read()
+                except (ConnectionError, http.client.HTTPException):
+                    conn.close()
+                    if reused:
+                        continue
+                    raise
+                except Exception:
+                    conn.close()
+                    raise
+                if res.will_close:
+                    conn.close()
+                else:
+                    self._release(key, conn)
+                return res.status, data
+        finally:
+            slot.release()
+
+    def clear(self):
+        '''Closes every idle connection.'''
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for conns in idle.values():
+            for conn, released in conns:
+                conn.close()
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            conns = self._idle.get(key, [])
+            while conns:
+                conn, released = conns.pop()
+                if now - released < self.idle_timeout and not conn.sock == None:
+                    return conn, True
+                conn.close()
+        if key[0]:
+            return http.client.HTTPSConnection(key[1], timeout=self.timeout), False
+        return http.client.HTTPConnection(key[1], timeout=self.timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+
+http_pool = HTTPConnectionPool()
+
 
 class Private:
     @staticmethod
     def _get_cluster(host, app_key):
+        return cluster_cache.get(host, app_key)
+
+    @staticmethod
+    def _fetch_cluster(host, app_key):
         try:
-            host += '?appkey='+app_key
-            from urllib.parse import urlparse
-            uri = urlparse(host)
-            conn = http.client.HTTPConnection(uri.netloc, timeout=REST_TIMEOUT)
-            conn.request("GET", uri.path + "?" + uri.query)
-            res = conn.getresponse()
-            if res.status == 200:
-                rbody = re.search('"(.*)"', res.read().decode()).group(0)
+            status, data = http_pool.request("GET", host+'?appkey='+app_key, secure=False)
+            if status == 200:
+                rbody = re.search('"(.*)"', data.decode()).group(0)
                 return rbody[1:][:-1]
         except Exception as e:
             #print(e)
             return None
 
+    @staticmethod
+    def _authentication_body(authentication_token, is_private, application_key, time_to_live, private_key, channels_permissions, valid_channels=None):
+        if not isinstance(channels_permissions, dict):
+            raise OrtcError('Invalid channels permissions')
+        body = ['AT='+authentication_token, 'AK='+application_key, 'PK='+private_key, 'TTL='+str(time_to_live), 'PVT='+('1' if is_private==True else '0'), 'TP='+str(len(channels_permissions))]
+        for k,v in channels_permissions.items():
+            if valid_channels == None or not k in valid_channels:
+                if not _permission_channel_re.match(k):
+                    raise OrtcError('Invalid channel name: '+k)
+                if not valid_channels == None:
+                    valid_channels.add(k)
+            body.append(k+'='+v)
+        return '&'.join(body)
+
+    @staticmethod
+    def _authentication_url(url, is_cluster, app_key):
+        server = Private._get_cluster(url, app_key) if is_cluster else url
+        if server == None:
+            raise OrtcError('Error getting server from Cluster')
+        return server + ('/authenticate' if not server[-1] == '/' else 'authenticate')
+
+    @staticmethod
+    def _reconnect_delay(attempts, interval, max_interval):
+        # exponential backoff with jitter, so a fleet of clients does not reconnect at once
+        delay = min(interval * 2 ** min(attempts, 16), max_interval)
+        return random.uniform(delay/2, delay)
+
     @staticmethod
     def _call_exception_callback(sender, exception):
-        if hasattr(sender,"on_exception_callback"):
-            sender.on_exception_callback(sender, exception)
+        callback = getattr(sender, 'on_exception_callback', None)
+        if callback:
+            callback(sender, exception)
 
     @staticmethod
     def _validate_url(url):
-        return True if re.compile('^\s*(http|https):\/\/(\w+:{0,1}\w*@)?(\S+)(:[0-9]+)?(\/|\/([\w#!:.?+=&%@!\-\/]))?\s*$').match(url) else False
+        return True if _url_re.match(url) else False
 
     @staticmethod
     def _validate_input(var):
-        return True if re.compile('^[\w\-:\/\.]*$').match(var) else False
+        return True if _input_re.match(var) else False
+
+    @staticmethod
+    def _channel_error(channel, max_size):
+        # the cache only skips the character checks, the size limit depends on the caller
+        if not type(channel) is str or not channel in _valid_channels:
+            if not isinstance(channel, str) or len(channel)<1:
+                return 'Channel is null or empty or not a string'
+            if not _input_re.match(channel):
+                return 'Channel has invalid characters'
+            if len(_valid_channels) >= MAX_VALID_CHANNELS:
+                _valid_channels.clear()
+            _valid_channels.add(channel)
+        if len(channel) > max_size:
+            return 'Channel size exceeds the limit of ' + str(max_size) + ' characters'
+        return None
 
     @staticmethod
     def _enum_state(**state):
@@ -133,6 +503,8 @@ class Private:
 
     @staticmethod
     def _check_permission(permissions, channel):
+        if isinstance(permissions, PermissionIndex):
+            return permissions.check(channel)
         if permissions == {}:
             return True, ''
         if channel in permissions:
@@ -142,44 +514,1009 @@ class Private:
                 return True, permissions[channel[:channel.index(':')]+':*']
         return False, ''
 
+    _rest_executor = None
+    _rest_executor_lock = threading.Lock()
+
     @staticmethod
-    def _rest_post_request(url, body, callback):
-        def p_thread():
-            try:
-                from urllib.parse import urlparse
-                uri = urlparse(url)
-                conn = http.client.HTTPSConnection(uri.netloc, timeout=REST_TIMEOUT)
-                headers = {}
-                headers['Content-Length'] = len(body)
-                conn.request("POST", uri.path, body, headers)
-                res = conn.getresponse()
-                if res.status==200:
-                    callback(None, res.read())
-                else:
-                    callback(str(res.status), None)
-            except Exception as e:
-                callback(str(e), None)
-        t = threading.Thread(target=p_thread)
-        t.setDaemon(True)
-        t.start()
+    def _rest_submit(request, callback=None):
+        with Private._rest_executor_lock:
+            if Private._rest_executor == None:
+                from concurrent.futures import ThreadPoolExecutor
+                Private._rest_executor = ThreadPoolExecutor(REST_WORKERS, thread_name_prefix='ortc-rest')
+        future = Private._rest_executor.submit(request)
+        if callback:
+            future.add_done_callback(lambda f: Private._rest_callback(f, callback))
+        return future
+
+    @staticmethod
+    def _rest_callback(future, callback):
+        try:
+            result = future.result()
+        except Exception as e:
+            callback(str(e), None)
+            return
+        callback(None, result)
+
+    @staticmethod
+    def _rest_error(error, callback=None):
+        from concurrent.futures import Future
+        future = Future()
+        future.set_exception(OrtcError(error))
+        if callback:
+            Private._rest_callback(future, callback)
+        return future
 
+    @staticmethod
+    def _rest_post(url, body):
+        headers = {}
+        headers['Content-Length'] = len(body)
+        status, data = http_pool.request("POST", url, body, headers, secure=True)
+        if not status==200:
+            raise OrtcError(str(status))
+        return data
 
     @staticmethod
-    def _prepare_server(url, is_cluster, app_key, callback):
+    def _rest_post_request(url, body, callback=None):
+        return Private._rest_submit(lambda: Private._rest_post(url, body), callback)
+
+    @staticmethod
+    def _prepare_server(url, is_cluster, app_key):
         server = Private._get_cluster(url, app_key) if is_cluster else url
         if server == None:
-            callback('Error getting server from Cluster', None)
-            return
+            raise OrtcError('Error getting server from Cluster')
         server += '/' if not server[-1] == '/' else ''
         return server
 
+
+class ClusterCache(object):
+    '''Caches the server resolved for a (cluster URL, application key) pair.
+
+    A server is reused for *ttl* seconds. For *stale_ttl* seconds more it is
+    still returned while a background thread resolves it again. A failed
+    lookup is remembered for *negative_ttl* seconds.
+    '''
+
+    def __init__(self, fetch, ttl=CLUSTER_CACHE_TTL, stale_ttl=CLUSTER_CACHE_STALE_TTL, negative_ttl=CLUSTER_CACHE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self._fetch = fetch
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, url, app_key):
+        '''Returns the server for the cluster, resolving it only when it is not cached.'''
+        found, server, refresh = self.peek(url, app_key)
+        if refresh:
+            t = threading.Thread(target=self.warm_up, args=(url, app_key))
+            t.setDaemon(True)
+            t.start()
+        if found:
+            return server
+        return self.warm_up(url, app_key)
+
+    def peek(self, url, app_key):
+        '''Returns (found, server, refresh) where *refresh* asks the caller to resolve the server again.'''
+        key = (url, app_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry == None:
+                return False, None, False
+            server, fetched = entry
+            age = time.monotonic() - fetched
+            if server == None:
+                return (True, None, False) if age < self.negative_ttl else (False, None, False)
+            if age < self.ttl:
+                return True, server, False
+            if age < self.ttl + self.stale_ttl:
+                refresh = not key in self._refreshing
+                self._refreshing.add(key)
+                return True, server, refresh
+            return False, None, False
+
+    def put(self, url, app_key, server):
+        key = (url, app_key)
+        now = time.monotonic()
+        with self._lock:
+            self._refreshing.discard(key)
+            entry = self._entries.get(key)
+            if server == None and not entry == None and not entry[0] == None and now - entry[1] < self.ttl + self.stale_ttl:
+                return
+            self._entries[key] = (server, now)
+
+    def warm_up(self, url, app_key):
+        '''Resolves the server for the cluster now and caches it, for instance at startup.'''
+        server = self._fetch(url, app_key)
+        self.put(url, app_key, server)
+        return server
+
+    def invalidate(self, url=None, app_key=None):
+        '''Forgets the server of a cluster, or every server if no cluster is given.'''
+        with self._lock:
+            if url == None:
+                self._entries.clear()
+            else:
+                self._entries.pop((url, app_key), None)
+
+
+cluster_cache = ClusterCache(Private._fetch_cluster)
+
+
+class PresenceCache(object):
+    '''Caches presence results per channel for *ttl* seconds and shares one request among concurrent lookups.'''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, channel, fetch):
+        '''Returns a Future of the cached presence of *channel*, calling *fetch* for a new Future only when there is none.'''
+        with self._lock:
+            entry = self._entries.get(channel)
+            if not entry == None and time.monotonic() - entry[1] < self.ttl:
+                from concurrent.futures import Future
+                future = Future()
+                future.set_result(entry[0])
+                return future
+            future = self._pending.get(channel)
+            if not future == None:
+                return future
+            future = self._pending[channel] = fetch()
+        future.add_done_callback(lambda f: self._fetched(channel, f))
+        return future
+
+    def invalidate(self, channel=None):
+        '''Forgets the presence of *channel*, or of every channel if omitted.'''
+        with self._lock:
+            if channel == None:
+                self._entries.clear()
+                self._pending.clear()
+            else:
+                self._entries.pop(channel, None)
+                self._pending.pop(channel, None)
+
+    def _fetched(self, channel, future):
+        # a request of the channel invalidated while in flight is no longer pending, and its result is not kept
+        with self._lock:
+            if not self._pending.get(channel) is future:
+                return
+            del self._pending[channel]
+            if not future.cancelled() and future.exception() == None:
+                self._entries[channel] = (future.result(), time.monotonic())
+
+
+overflow_policies = Private._enum_state(BLOCK=0, DROP_OLDEST=1, RAISE=2)
+
+
+class SendQueue(object):
+    '''Bounded queue of outgoing frames drained by a single writer thread.
+
+    Frames are queued per message, the frames passed to one put() call. The
+    writer takes queued messages until it has *max_batch* frames and writes
+    them with one call to *write* per *max_batch* frames, as a SockJS message
+    array when there is more than one. When *max_size* frames are queued,
+    *overflow* decides whether put() blocks, drops the oldest messages or
+    raises OrtcError. Whole messages are dropped, so the receivers are not
+    left with parts they can never reassemble.
+    '''
+
+    def __init__(self, write, max_size, overflow=overflow_policies.BLOCK, on_error=None, max_batch=64):
+        self.max_size = max_size
+        self.overflow = overflow
+        self.max_batch = max_batch
+        self.max_depth = 0
+        self.dropped = 0
+        self.sent = 0
+        self.writes = 0
+        self._write = write
+        self._on_error = on_error
+        self._messages = collections.deque()
+        self._depth = 0
+        self._cond = threading.Condition()
+        self._busy = False
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def put(self, frames):
+        '''Queues the frames of a message.'''
+        count = len(frames)
+        with self._cond:
+            # a message larger than the queue is accepted once the queue is empty
+            while self._depth and self._depth + count > self.max_size and self._running:
+                if self.overflow == overflow_policies.RAISE:
+                    raise OrtcError('Send queue is full')
+                if self.overflow == overflow_policies.DROP_OLDEST:
+                    self._depth -= len(self._messages.popleft())
+                    self.dropped += 1
+                else:
+                    self._cond.wait()
+            if not self._running:
+                return
+            self._messages.append(frames)
+            self._depth += count
+            if self._depth > self.max_depth:
+                self.max_depth = self._depth
+            self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        '''Waits until every queued frame is written. Returns False if *timeout* seconds elapsed first.'''
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._messages and not self._busy, timeout)
+
+    def close(self):
+        '''Stops the writer thread, discarding the frames not yet written.'''
+        with self._cond:
+            self._running = False
+            self._messages.clear()
+            self._depth = 0
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._messages and self._running:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                batch = []
+                while self._messages and len(batch) < self.max_batch:
+                    batch.extend(self._messages.popleft())
+                self._depth -= len(batch)
+                self._busy = True
+                self._cond.notify_all()
+            writes = 0
+            try:
+                for i in range(0, len(batch), self.max_batch):
+                    frames = batch[i:i+self.max_batch]
+                    self._write(frames[0] if len(frames) == 1 else FrameEncoder.batch(frames))
+                    writes += 1
+            except Exception as e:
+                if self._on_error:
+                    self._on_error(e)
+            with self._cond:
+                self._busy = False
+                self.sent += len(batch)
+                self.writes += writes
+                self._cond.notify_all()
+
+
+dispatch_modes = Private._enum_state(INLINE=0, POOL=1, PER_CHANNEL=2)
+
+
+class Dispatcher(object):
+    '''Runs the message callbacks of a client.
+
+    * INLINE calls them on the receive thread.
+    * POOL runs them on *workers* threads, in no particular order.
+    * PER_CHANNEL runs the messages of a channel one at a time and in order, while different channels run in parallel on the *workers* threads.
+
+    At most *max_queue* messages wait per channel (in total for POOL), and
+    *overflow* decides whether the oldest message is dropped (the default),
+    OrtcError is raised or the receive thread blocks when that bound is
+    reached. BLOCK lets one slow channel stall the receive thread, and with
+    it every other channel. *last_lag* and *max_lag* are the seconds between
+    a message arrival and the start of its callback, *dropped* counts the
+    messages dropped.
+    '''
+
+    def __init__(self, mode=dispatch_modes.INLINE, workers=4, max_queue=10000, overflow=overflow_policies.DROP_OLDEST, on_error=None):
+        self.mode = mode
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.on_error = on_error
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.dispatched = 0
+        self.dropped = 0
+        self._limit = 1 if mode == dispatch_modes.PER_CHANNEL else workers
+        self._queues = {}
+        self._active = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._executor = None
+        if not mode == dispatch_modes.INLINE:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(workers)
+
+    def depth(self, channel=None):
+        '''Returns the number of messages waiting on *channel*, or on every channel if omitted.'''
+        with self._cond:
+            if channel == None:
+                return sum([len(q) for q in self._queues.values()])
+            queue = self._queues.get(channel if self.mode == dispatch_modes.PER_CHANNEL else None)
+            return len(queue) if queue else 0
+
+    def dispatch(self, channel, callback, *args):
+        if self._executor == None or self._closed or not self._enqueue(channel, callback, args):
+            self.dispatched += 1
+            callback(*args)
+
+    def close(self):
+        '''Stops the worker threads once the messages already queued are dispatched. Later messages run inline.'''
+        with self._cond:
+            self._closed = True
+        if not self._executor == None:
+            self._executor.shutdown(wait=False)
+
+    def _enqueue(self, channel, callback, args):
+        # returns False when the dispatcher was closed meanwhile, by the client replacing it
+        key = channel if self.mode == dispatch_modes.PER_CHANNEL else None
+        with self._cond:
+            if self._closed:
+                return False
+            while True:
+                queue = self._queues.get(key)
+                if queue == None:
+                    queue = self._queues[key] = collections.deque()
+                if len(queue) < self.max_queue:
+                    break
+                if self.overflow == overflow_policies.DROP_OLDEST:
+                    queue.popleft()
+                    self.dropped += 1
+                elif self.overflow == overflow_policies.RAISE:
+                    raise OrtcError('Dispatch queue is full for channel: '+channel)
+                else:
+                    self._cond.wait()
+            queue.append((time.monotonic(), callback, args))
+            active = self._active.get(key, 0)
+            if active < self._limit:
+                self._active[key] = active + 1
+                self._executor.submit(self._drain, key)
+        return True
+
+    def _drain(self, key):
+        while True:
+            with self._cond:
+                queue = self._queues.get(key)
+                if not queue:
+                    self._active[key] -= 1
+                    if self._active[key] == 0:
+                        del self._active[key]
+                        self._queues.pop(key, None)
+                    return
+                received, callback, args = queue.popleft()
+                self._cond.notify_all()
+            lag = time.monotonic() - received
+            self.last_lag = lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            self.dispatched += 1
+            try:
+                callback(*args)
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(e)
+
+
+class ScheduledCall(object):
+    '''A callback registered in a Scheduler, which can be cancelled before it runs.'''
+    def __init__(self, deadline, callback, args, on_error=None):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.on_error = on_error
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+    def cancel(self):
+        self.callback = None
+
+
+class Scheduler(object):
+    '''Runs callbacks at deadlines of the monotonic clock, on a single thread.
+
+    The thread sleeps until the nearest deadline instead of polling, so idle
+    clients cost no wakeups. Callbacks must return quickly; work that blocks
+    belongs on another thread. An exception raised by a callback is passed to
+    the *on_error* of its call, or printed to stderr.
+    '''
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        '''Returns the scheduler shared by every client of the process.'''
+        with cls._shared_lock:
+            if cls._shared == None:
+                cls._shared = Scheduler()
+            return cls._shared
+
+    def __init__(self):
+        self._calls = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def call_later(self, delay, callback, *args, on_error=None):
+        '''Runs *callback* with *args* in *delay* seconds and returns its ScheduledCall.'''
+        call = ScheduledCall(time.monotonic() + delay, callback, args, on_error)
+        with self._cond:
+            heapq.heappush(self._calls, call)
+            if self._calls[0] is call:
+                self._cond.notify()
+        return call
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._calls:
+                        self._cond.wait()
+                        continue
+                    wait = self._calls[0].deadline - time.monotonic()
+                    if wait <= 0:
+                        call = heapq.heappop(self._calls)
+                        break
+                    self._cond.wait(wait)
+            callback = call.callback
+            if callback == None:
+                continue
+            try:
+                callback(*call.args)
+            except Exception as e:
+                self._error(call, e)
+
+    def _error(self, call, e):
+        if call.on_error:
+            try:
+                call.on_error(e)
+                return
+            except Exception:
+                pass
+        traceback.print_exception(type(e), e, e.__traceback__)
+
+
+class AckBatch(object):
+    '''A batch of channel requests waiting for server acknowledgements.'''
+    __slots__ = ('future', 'pending', 'results', 'timer')
+
+    def __init__(self, keys, results):
+        from concurrent.futures import Future
+        self.future = Future()
+        self.pending = set(keys)
+        self.results = results
+        self.timer = None
+
+
+class AckTracker(object):
+    '''Matches server acknowledgements to the batches of requests waiting for them.
+
+    A request is identified by an *(operation, channel)* key. Each batch
+    completes its Future with a dictionary of channel to error, None for the
+    channels the server confirmed, once every key is settled or its timeout
+    expires.
+    '''
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._waiting = {}
+        self._lock = threading.Lock()
+
+    def track(self, keys, results=None, timeout=None):
+        '''Returns the AckBatch waiting for *keys*, with *results* already known for other channels.'''
+        batch = AckBatch(keys, results if not results == None else {})
+        with self._lock:
+            for key in batch.pending:
+                self._waiting.setdefault(key, []).append(batch)
+        if not batch.pending:
+            batch.future.set_result(batch.results)
+        elif not timeout == None:
+            batch.timer = self._scheduler.call_later(timeout, self._expire, batch)
+        return batch
+
+    def settle(self, key, error=None):
+        '''Records the acknowledgement, or the *error*, of the request *key*.'''
+        with self._lock:
+            batches = self._waiting.pop(key, None)
+            if batches == None:
+                return
+            done = [batch for batch in batches if self._settle(batch, key, error)]
+        self._complete(done)
+
+    def fail(self, batch, error):
+        '''Settles every request of *batch* still waiting with *error*.'''
+        with self._lock:
+            done = [batch] if batch.pending else []
+            for key in list(batch.pending):
+                batches = self._waiting.get(key)
+                if not batches == None and batch in batches:
+                    batches.remove(batch)
+                    if not batches:
+                        del self._waiting[key]
+                self._settle(batch, key, error)
+        self._complete(done)
+
+    def fail_all(self, error):
+        '''Settles every request still waiting with *error*.'''
+        with self._lock:
+            done = []
+            for key, batches in self._waiting.items():
+                done.extend([batch for batch in batches if self._settle(batch, key, error)])
+            self._waiting = {}
+        self._complete(done)
+
+    @property
+    def pending(self):
+        '''The number of requests waiting for an acknowledgement (read only)'''
+        return len(self._waiting)
+
+    def _expire(self, batch):
+        self.fail(batch, 'Timed out waiting for the server acknowledgement')
+
+    def _settle(self, batch, key, error):
+        # called with the lock held, returns True when the batch has no request left
+        if not key in batch.pending:
+            return False
+        batch.pending.discard(key)
+        batch.results[key[1]] = error
+        return not batch.pending
+
+    def _complete(self, batches):
+        for batch in batches:
+            if not batch.timer == None:
+                batch.timer.cancel()
+            batch.future.set_result(batch.results)
+
+
+priorities = Private._enum_state(CRITICAL=0, HIGH=1, NORMAL=2, LOW=3)
+
+
+class Resubscription(object):
+    '''Restores the subscriptions of a reconnected client, most important first.
+
+    *channels* is a list of *(priority, channel)* pairs. Channels are requested
+    in order of priority, at most *rate* per second (0 for no limit), in
+    batches written every *interval* seconds from the scheduler thread, so a
+    fleet of clients reconnecting after a failover does not flood the server.
+    *request(channels)* writes the subscribe requests of a batch and returns
+    the channels it requested. confirmed() is called for each acknowledgement
+    and calls *on_progress(restored, total)*. Errors of *request* are passed
+    to *on_error*.
+    '''
+
+    def __init__(self, scheduler, channels, request, rate, interval=0.1, on_progress=None, on_error=None):
+        self.total = len(channels)
+        self.requested = 0
+        self.restored = 0
+        self.started = time.monotonic()
+        self.elapsed = None
+        self._scheduler = scheduler
+        self._request = request
+        self._batch = max(1, int(rate * interval)) if rate else max(1, self.total)
+        self._interval = interval
+        self._on_progress = on_progress
+        self._on_error = on_error
+        self._queue = collections.deque([channel for priority, channel in sorted(channels, key=lambda c: c[0])])
+        self._waiting = set(self._queue)
+        self._lock = threading.Lock()
+        self._cancelled = False
+        with self._lock:
+            self._timer = scheduler.call_later(0, self._tick, on_error=on_error)
+
+    @property
+    def done(self):
+        '''Indicates whether every channel was restored (read only)'''
+        return not self.elapsed == None
+
+    def confirmed(self, channel):
+        '''Records the server acknowledgement of *channel*.'''
+        with self._lock:
+            if not channel in self._waiting:
+                return
+            self._waiting.discard(channel)
+            self.restored += 1
+            restored, total = self.restored, self.total
+            self._check_done()
+        if self._on_progress:
+            self._on_progress(restored, total)
+
+    def cancel(self):
+        '''Stops requesting the channels not requested yet.'''
+        with self._lock:
+            self._cancelled = True
+            self._queue.clear()
+        self._timer.cancel()
+
+    def stats(self):
+        '''Returns a dictionary with the channel counts and the seconds taken to restore every channel.'''
+        with self._lock:
+            return {'total': self.total, 'requested': self.requested, 'restored': self.restored, 'pending': len(self._queue),
+                    'elapsed': self.elapsed if not self.elapsed == None else time.monotonic() - self.started, 'done': self.done}
+
+    def _tick(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            batch = [self._queue.popleft() for i in range(min(self._batch, len(self._queue)))]
+        requested = self._request(batch) if batch else []
+        with self._lock:
+            self.requested += len(requested)
+            for channel in set(batch) - set(requested):
+                # unsubscribed meanwhile or no longer permitted
+                if channel in self._waiting:
+                    self._waiting.discard(channel)
+                    self.total -= 1
+            self._check_done()
+            if self._queue and not self._cancelled:
+                self._timer = self._scheduler.call_later(self._interval, self._tick, on_error=self._on_error)
+
+    def _check_done(self):
+        if not self._waiting and not self._queue and self.elapsed == None:
+            self.elapsed = time.monotonic() - self.started
+
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram(object):
+    '''Counts observed values in fixed buckets, with their sum and maximum.'''
+    __slots__ = ('bounds', 'buckets', 'count', 'sum', 'max')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        '''Returns the upper bound of the bucket holding the *q* quantile, or the maximum for the last bucket.'''
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max, 'p50': self.quantile(0.5), 'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99), 'buckets': list(zip(self.bounds + (float('inf'),), self.buckets))}
+
+
+class Metrics(object):
+    '''Counters, gauges and latency histograms, in seconds, of a client.
+
+    Updates are plain arithmetic without locks, so they stay cheap on the
+    receive and send paths; a snapshot taken while another thread updates may
+    miss the updates in flight. Gauges are functions read at snapshot time.
+
+    Usage:
+
+    >>> print ortc_client.metrics.snapshot()['counters']['frames_received']
+    >>> text = ortc_client.metrics.prometheus()
+    '''
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.histograms = {}
+        self._gauges = {}
+
+    def incr(self, name, value=1):
+        self.counters[name] += value
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram == None:
+            histogram = self.histograms.setdefault(name, Histogram())
+        histogram.observe(value)
+
+    def gauge(self, name, read):
+        '''Registers *read*, a function returning the current value of the gauge *name*.'''
+        self._gauges[name] = read
+
+    def gauges(self):
+        values = {}
+        for name, read in list(self._gauges.items()):
+            try:
+                values[name] = read()
+            except Exception:
+                pass
+        return values
+
+    def snapshot(self):
+        '''Returns a dictionary with the counters, gauges and histograms.'''
+        return {'counters': dict(self.counters), 'gauges': self.gauges(),
+                'histograms': dict((name, h.snapshot()) for name, h in list(self.histograms.items()))}
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+    def prometheus(self, prefix='ortc', labels=None):
+        '''Returns the metrics in the Prometheus text exposition format, with the optional *labels* dictionary on every sample.'''
+        label = ','.join(['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in sorted((labels or {}).items())])
+        def sample(name, value, extra=''):
+            tags = ','.join([t for t in (label, extra) if t])
+            return '%s%s %s' % (name, '{'+tags+'}' if tags else '', repr(float(value)) if isinstance(value, float) else value)
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines.append('# TYPE %s_%s_total counter' % (prefix, name))
+            lines.append(sample('%s_%s_total' % (prefix, name), value))
+        for name, value in sorted(self.gauges().items()):
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            lines.append(sample('%s_%s' % (prefix, name), value))
+        for name, h in sorted(self.histograms.items()):
+            metric = '%s_%s_seconds' % (prefix, name)
+            lines.append('# TYPE %s histogram' % metric)
+            cumulative = 0
+            for bound, n in zip(h.bounds + (float('inf'),), h.buckets):
+                cumulative += n
+                lines.append(sample(metric+'_bucket', cumulative, 'le="%s"' % ('+Inf' if bound == float('inf') else repr(float(bound)))))
+            lines.append(sample(metric+'_sum', h.sum))
+            lines.append(sample(metric+'_count', h.count))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsDExporter(object):
+    '''Sends the metrics of a client to a StatsD server over UDP every *interval* seconds.
+
+    Counters are sent as the increments since the previous flush, gauges as
+    gauges, and each histogram as the gauges *p50*, *p99* and *max* in
+    milliseconds.
+
+    Usage:
+
+    >>> exporter = StatsDExporter(ortc_client.metrics, 'localhost', 8125, 'myapp.ortc')
+    >>> exporter.close()
+    '''
+
+    def __init__(self, metrics, host='127.0.0.1', port=8125, prefix='ortc', interval=10, scheduler=None):
+        self.metrics = metrics
+        self.address = (host, port)
+        self.prefix = prefix
+        self.interval = interval
+        self._sent = {}
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._scheduler = scheduler if not scheduler == None else Scheduler.shared()
+        self._timer = self._scheduler.call_later(interval, self._tick)
+
+    def lines(self):
+        '''Returns the StatsD lines of the next flush.'''
+        lines = []
+        for name, value in list(self.metrics.counters.items()):
+            delta = value - self._sent.get(name, 0)
+            if delta < 0:
+                delta = value
+            self._sent[name] = value
+            if delta:
+                lines.append('%s.%s:%d|c' % (self.prefix, name, delta))
+        for name, value in self.metrics.gauges().items():
+            lines.append('%s.%s:%s|g' % (self.prefix, name, value))
+        for name, h in list(self.metrics.histograms.items()):
+            for stat, value in (('p50', h.quantile(0.5)), ('p99', h.quantile(0.99)), ('max', h.max)):
+                lines.append('%s.%s.%s:%.3f|g' % (self.prefix, name, stat, value * 1000))
+        return lines
+
+    def flush(self):
+        '''Sends the metrics now, in datagrams of at most 1400 bytes.'''
+        packet = ''
+        for line in self.lines():
+            if packet and len(packet) + len(line) + 1 > 1400:
+                self._socket.sendto(packet.encode(), self.address)
+                packet = ''
+            packet += ('\n' if packet else '') + line
+        if packet:
+            self._socket.sendto(packet.encode(), self.address)
+
+    def close(self):
+        '''Stops the periodic flushes and closes the socket.'''
+        self._timer.cancel()
+        self._socket.close()
+
+    def _tick(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+        self._timer = self._scheduler.call_later(self.interval, self._tick)
+
+
+_base36 = string.digits + string.ascii_uppercase
+
+
+def _to_base36(n, width=0):
+    digits = []
+    while n:
+        n, r = divmod(n, 36)
+        digits.append(_base36[r])
+    return ''.join(reversed(digits)).rjust(width, '0')
+
+
+class TraceStats(object):
+    '''Delivery statistics of the traced messages received on a channel.'''
+    __slots__ = ('received', 'gaps', 'reordered', 'duplicates', 'last_latency', 'latency', '_senders')
+
+    def __init__(self):
+        self.received = 0
+        self.gaps = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.last_latency = 0.0
+        self.latency = Histogram()
+        self._senders = {}
+
+    def snapshot(self):
+        return {'received': self.received, 'gaps': self.gaps, 'reordered': self.reordered, 'duplicates': self.duplicates,
+                'last_latency': self.last_latency, 'latency': self.latency.snapshot()}
+
+
+class Tracer(object):
+    '''Stamps outgoing message ids and measures the delivery of stamped messages.
+
+    A traced message id is "T", a 4 character sender tag, the send time in
+    milliseconds since the epoch as 8 base 36 digits, and a sequence number
+    per sender and channel in base 36. It fits the id field every message
+    already carries, so payloads are unchanged and clients without tracing
+    ignore it. The receiver computes the latency against its own clock, so
+    it is only as accurate as the clock synchronization of both hosts.
+    '''
+
+    def __init__(self):
+        self.sender = ''.join(random.choice(string.ascii_uppercase + string.digits) for x in range(4))
+        self._sequences = {}
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def message_id(self, channel):
+        '''Returns a traced message id for the next message sent to *channel*.'''
+        with self._lock:
+            sequence = self._sequences.get(channel, 0) + 1
+            self._sequences[channel] = sequence
+        return 'T' + self.sender + _to_base36(int(time.time() * 1000), 8) + _to_base36(sequence)
+
     @staticmethod
-    def _prepare_server_internal(url, cluster_url, app_key, callback):
-        if app_key == None:
-            callback('Please, do connect first', None)
-            return False, None
-        server = Private._get_cluster(cluster_url, app_key) if not cluster_url == None else url
-        if server == None:
-            callback('Error getting server from Cluster', None)
-            return False, None
-        return True, server
+    def parse(message_id):
+        '''Returns (sender, sent_time, sequence) of a traced message id, or None.'''
+        if message_id == None or len(message_id) < 14 or not message_id[0] == 'T':
+            return None
+        try:
+            return message_id[1:5], int(message_id[5:13], 36) / 1000.0, int(message_id[13:], 36)
+        except ValueError:
+            return None
+
+    def received(self, channel, message_id):
+        '''Records the delivery of *message_id* on *channel* and returns its latency, or None if it is not traced.'''
+        trace = Tracer.parse(message_id)
+        if trace == None:
+            return None
+        sender, sent, sequence = trace
+        latency = max(time.time() - sent, 0.0)
+        with self._lock:
+            stats = self._channels.get(channel)
+            if stats == None:
+                stats = self._channels[channel] = TraceStats()
+            stats.received += 1
+            stats.last_latency = latency
+            stats.latency.observe(latency)
+            last = stats._senders.get(sender)
+            if last == None or sequence > last:
+                if not last == None and sequence > last + 1:
+                    stats.gaps += sequence - last - 1
+                stats._senders[sender] = sequence
+            elif sequence == last:
+                stats.duplicates += 1
+            else:
+                # a late message fills one of the gaps counted before
+                stats.reordered += 1
+                if stats.gaps:
+                    stats.gaps -= 1
+        return latency
+
+    def stats(self, channel=None):
+        '''Returns the delivery statistics of *channel*, or a dictionary of them per channel if omitted.'''
+        with self._lock:
+            if not channel == None:
+                stats = self._channels.get(channel)
+                return stats.snapshot() if not stats == None else None
+            return dict((name, stats.snapshot()) for name, stats in self._channels.items())
+
+    def reset(self):
+        with self._lock:
+            self._channels.clear()
+
+
+COMPRESSED_PREFIX = '~z'
+BINARY_PREFIX = '~b'
+COMPRESSED_BINARY_PREFIX = '~c'
+PAYLOAD_PREFIXES = (COMPRESSED_PREFIX, BINARY_PREFIX, COMPRESSED_BINARY_PREFIX)
+MAX_DECOMPRESSED_SIZE = 16*1024*1024
+
+
+class PayloadCodec(object):
+    '''Encodes binary message payloads and compresses large ones, as text.
+
+    Bytes are encoded as Base64 text. When *enabled*, messages of at least
+    *threshold* characters that get smaller are compressed with zlib,
+    optionally against a preset *dictionary* of bytes shared by every client,
+    which helps small messages with a common structure, and then encoded as
+    Base64. The id of an encoded message starts with one of
+    PAYLOAD_PREFIXES, which no plain id does, so receivers detect it after
+    reassembly. zlib records which dictionary was used, and a receiver
+    without it fails with OrtcError. So does a message which decompresses to
+    more than *max_size* bytes, which is never fully inflated in memory.
+    '''
+
+    def __init__(self, enabled=False, threshold=1024, dictionary=None, level=6, max_size=MAX_DECOMPRESSED_SIZE):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.dictionary = dictionary
+        self.level = level
+        self.max_size = max_size
+
+    def encode(self, message):
+        '''Returns the message id prefix and the text to send for *message*, a str or a bytes-like object.'''
+        if isinstance(message, str):
+            compressed = self.compress(message) if self.enabled else None
+            return ('', message) if compressed == None else (COMPRESSED_PREFIX, compressed)
+        data = memoryview(message).cast('B')
+        compressed = self.compress(data) if self.enabled else None
+        if compressed == None:
+            return BINARY_PREFIX, b64encode(data).decode('ascii')
+        return COMPRESSED_BINARY_PREFIX, compressed
+
+    def unwrap(self, message_id, message, binary=False):
+        '''Returns the id of a reassembled message without its payload prefix, and the message it encodes.'''
+        if message_id == None or not message_id[:2] in PAYLOAD_PREFIXES:
+            return message_id, message
+        return message_id[2:], self.decode(message_id[:2], message, binary)
+
+    def decode(self, prefix, text, binary=True):
+        '''Returns the message sent as *text* with the id *prefix*. Binary messages stay encoded text unless *binary*.'''
+        if prefix == COMPRESSED_PREFIX:
+            return self.decompress(text)
+        if not binary:
+            return text
+        if prefix == COMPRESSED_BINARY_PREFIX:
+            return self.decompress(text, True)
+        try:
+            return b64decode(text, validate=True)
+        except ValueError as e:
+            raise OrtcError('Unable to decode binary message: ' + str(e))
+
+    def compress(self, message):
+        '''Returns the compressed text of *message*, a str or a bytes-like object, or None when it is not worth compressing.'''
+        binary = not isinstance(message, str)
+        size = len(message) if not binary else (memoryview(message).nbytes + 2) // 3 * 4
+        if size < self.threshold:
+            return None
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS, 8, zlib.Z_DEFAULT_STRATEGY, self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        text = b64encode(compressor.compress(message if binary else message.encode('utf-8')) + compressor.flush()).decode('ascii')
+        return text if len(text) < size else None
+
+    def decompress(self, text, binary=False):
+        '''Returns the message compressed in *text*, as bytes if *binary*.'''
+        try:
+            decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+            data = decompressor.decompress(b64decode(text, validate=True), self.max_size)
+            if decompressor.unconsumed_tail:
+                raise OrtcError('Decompressed message exceeds the limit of ' + str(self.max_size) + ' bytes')
+            if not decompressor.eof:
+                raise OrtcError('Truncated compressed message')
+            return data if binary else data.decode('utf-8')
+        except (ValueError, zlib.error) as e:
+            raise OrtcError('Unable to decompress message: ' + str(e))
@@ -0,0 +1,207 @@
+"""ORTC Python API for running many client sessions on one I/O thread."""
+
+__author__      = "framework@realtime.co"
+__copyright__   = "Copyright 2015, Realtime "
+
+
+import asyncio
+import threading
+from ortc_extensibility import *
+from ortc_async import AsyncOrtcClient
+
+
+class OrtcHub(object):
+    """Drives many ORTC sessions from a single event loop thread.
+
+    Every client created by the hub shares the same selector for its
+    websocket, and the same loop scheduler for heartbeat timeouts and
+    reconnect delays, instead of owning a receive, heartbeat and reconnect
+    thread of its own. Callbacks run on the hub thread.
+
+    Requires the websockets module.
+
+    Usage:
+
+    >>> hub = ortc_hub.OrtcHub()
+    >>> ortc_client = hub.client()
+    >>> ortc_client.cluster_url = "https://ortc-developers.realtime.co/server/ssl/2.1"
+    >>> ortc_client.set_on_connected_callback(on_connected)
+    >>> ortc_client.connect('Your application key', 'Your authentication token')
+    """
+
+    def __init__(self):
+        self._clients = []
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    @property
+    def clients(self):
+        '''The clients created by the hub (read only)'''
+        return list(self._clients)
+
+    def client(self):
+        '''Creates a client with the same API as ortc.OrtcClient that runs on the hub.'''
+        client = HubClient(self)
+        self._clients.append(client)
+        return client
+
+    def close(self, timeout=None):
+        '''Disconnects every client and stops the hub thread.'''
+        async def close_all():
+            for client in self._clients:
+                try:
+                    await client._client.disconnect()
+                except OrtcError:
+                    pass
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    def _submit(self, coro, on_error, on_result=None):
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        def done(f):
+            try:
+                result = f.result()
+            except Exception as e:
+                on_error(str(e))
+                return
+            if on_result:
+                on_result(result)
+        future.add_done_callback(done)
+        return future
+
+
+class HubClient(object):
+    """An ORTC client session driven by an OrtcHub.
+
+    It has the same properties, methods and callbacks as ortc.OrtcClient.
+    Methods return immediately and errors are reported through the exception
+    callback.
+    """
+
+    @property
+    def announcement_subchannel(self):
+        '''The client announcement subchannel'''
+        return self._client.announcement_subchannel
+    @announcement_subchannel.setter
+    def announcement_subchannel(self, announcement_subchannel):
+        self._client.announcement_subchannel = announcement_subchannel
+
+    @property
+    def connection_metadata(self):
+        '''The client connection metadata'''
+        return self._client.connection_metadata
+    @connection_metadata.setter
+    def connection_metadata(self, connection_metadata):
+        self._client.connection_metadata = connection_metadata
+
+    @property
+    def binary_messages(self):
+        '''Indicates whether binary messages, sent as bytes, are received as bytes'''
+        return self._client.binary_messages
+    @binary_messages.setter
+    def binary_messages(self, binary_messages):
+        self._client.binary_messages = binary_messages
+
+    @property
+    def url(self):
+        '''The server URL'''
+        return self._client.url
+    @url.setter
+    def url(self, url):
+        self._client.url = url
+
+    @property
+    def cluster_url(self):
+        '''The cluster server URL'''
+        return self._client.cluster_url
+    @cluster_url.setter
+    def cluster_url(self, cluster_url):
+        self._client.cluster_url = cluster_url
+
+    @property
+    def is_connected(self):
+        '''Indicates whether the client is connected (read only)'''
+        return self._client.is_connected
+
+    @property
+    def session_id(self):
+        '''The client session identifier (read only)'''
+        return self._client.session_id
+
+    def __init__(self, hub):
+        self._hub = hub
+        self._client = AsyncOrtcClient()
+
+    def connect(self, application_key, authentication_token='PM.Anonymous'):
+        '''Connects the client using the supplied application key and authentication token.'''
+        self._submit(self._client.connect(application_key, authentication_token))
+
+    def disconnect(self):
+        '''Disconnects the client.'''
+        self._submit(self._client.disconnect())
+
+    def is_subscribed(self, channel):
+        '''Indicates whether the client is subscribed to the supplied channel.'''
+        return self._client.is_subscribed(channel)
+
+    def subscribe(self, channel, subscribe_on_reconnect, on_message):
+        '''Subscribes to the supplied channel to receive messages sent to it.'''
+        if not hasattr(on_message, '__call__'):
+            Private._call_exception_callback(self, 'The argument \'onMessageCallback\' must be a function')
+            return
+        self._submit(self._client.subscribe(channel, subscribe_on_reconnect, lambda sender, ch, message: on_message(self, ch, message)))
+
+    def unsubscribe(self, channel):
+        '''Unsubscribes from the supplied channel to stop receiving messages sent to it.'''
+        self._submit(self._client.unsubscribe(channel))
+
+    def send(self, channel, message):
+        '''Sends the supplied message to the supplied channel.'''
+        self._submit(self._client.send(channel, message))
+
+    def presence(self, channel, callback):
+        '''Gets a dictionary indicating the subscriptions number in the specified channel and if active the first 100 unique metadata.'''
+        self._hub._submit(self._client.presence(channel), lambda e: callback(e, None), lambda r: callback(None, r))
+
+    def enable_presence(self, private_key, channel, metadata, callback):
+        '''Enables presence for the specified channel with first 100 unique metadata if true.'''
+        self._hub._submit(self._client.enable_presence(private_key, channel, metadata), lambda e: callback(e, None), lambda r: callback(None, r))
+
+    def disable_presence(self, private_key, channel, callback):
+        '''Disables presence for the specified channel.'''
+        self._hub._submit(self._client.disable_presence(private_key, channel), lambda e: callback(e, None), lambda r: callback(None, r))
+
+    def set_on_exception_callback(self, callback):
+        '''Sets the callback which occurs when there is an exception.'''
+        self.on_exception_callback = callback
+        self._client.on_exception_callback = lambda sender, exception: callback(self, exception)
+
+    def set_on_connected_callback(self, callback):
+        '''Sets the callback which occurs when the client connects.'''
+        self._client.on_connected_callback = lambda sender: callback(self)
+
+    def set_on_disconnected_callback(self, callback):
+        '''Sets the callback which occurs when the client disconnects.'''
+        self._client.on_disconnected_callback = lambda sender: callback(self)
+
+    def set_on_reconnected_callback(self, callback):
+        '''Sets the callback which occurs when the client reconnects.'''
+        self._client.on_reconnected_callback = lambda sender: callback(self)
+
+    def set_on_reconnecting_callback(self, callback):
+        '''Sets the callback which occurs when the client attempts to reconnect.'''
+        self._client.on_reconnecting_callback = lambda sender: callback(self)
+
+    def set_on_subscribed_callback(self, callback):
+        '''Sets the callback which occurs when the client subscribes to a channel.'''
+        self._client.on_subscribed_callback = lambda sender, channel: callback(self, channel)
+
+    def set_on_unsubscribed_callback(self, callback):
+        '''Sets the callback which occurs when the client unsubscribes from a channel.'''
+        self._client.on_unsubscribed_callback = lambda sender, channel: callback(self, channel)
+
+    def _submit(self, coro):
+        self._hub._submit(coro, lambda e: Private._call_exception_callback(self, e))
@@ -0,0 +1,396 @@
+"""A local stand-in for an ORTC cluster, for integration and load tests without network access."""
+
+__author__      = "framework@realtime.co"
+__copyright__   = "Copyright 2015, Realtime "
+
+
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qs, unquote
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+HEARTBEAT_INTERVAL = 25
+SESSION_TIME_TO_LIVE = 1800
+MAX_FRAME_SIZE = 16*1024*1024
+
+
+class _Session(object):
+    __slots__ = ('writer', 'validated', 'token', 'permissions', 'metadata', 'channels')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.validated = False
+        self.token = None
+        self.permissions = None
+        self.metadata = ''
+        self.channels = set()
+
+
+class OrtcServer(object):
+    """Emulates an ORTC cluster on a loopback port, on a single event loop thread.
+
+    It serves the cluster endpoint, the SockJS websocket (validate, subscribe,
+    unsubscribe and send with multipart relay, and heartbeats), and the
+    presence and authenticate REST endpoints, with the standard library only.
+
+    * *application_key* - The only application key accepted, any if None.
+    * *private_key* - The only private key accepted by the REST endpoints, any if None.
+    * *authentication_required* - Indicates whether a connection needs a token saved with save_authentication.
+    * *heartbeat_interval* - The seconds between heartbeat frames, None to send none.
+
+    Usage:
+
+    >>> server = ortc_server.OrtcServer()
+    >>> server.start()
+    >>> ortc.http_pool.follow_scheme = True
+    >>> ortc_client.cluster_url = server.cluster_url
+    >>> ortc_client.connect('Your application key')
+    >>> server.drop_connections()
+    >>> server.stop()
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, application_key=None, private_key=None, authentication_required=False, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.host = host
+        self.port = port
+        self.application_key = application_key
+        self.private_key = private_key
+        self.authentication_required = authentication_required
+        self.heartbeat_interval = heartbeat_interval
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.messages_relayed = 0
+        self._tokens = {}
+        self._presence = {}
+        self._sessions = set()
+        self._connections = {}
+        self._subscribers = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        '''The server URL, to set as OrtcClient.url (read only)'''
+        return 'http://%s:%d' % (self.host, self.port)
+
+    @property
+    def cluster_url(self):
+        '''The cluster URL, to set as OrtcClient.cluster_url (read only)'''
+        return self.url + '/server/2.1'
+
+    @property
+    def stats(self):
+        '''Counts of the connections, channels, and frames handled so far (read only)'''
+        return {'connections': len(self._sessions), 'channels': len(self._subscribers), 'frames_received': self.frames_received,
+                'frames_sent': self.frames_sent, 'messages_relayed': self.messages_relayed}
+
+    def start(self):
+        '''Starts listening, and returns once the port is bound.'''
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(asyncio.start_server(self._handle, self.host, self.port), self._loop).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def stop(self, timeout=None):
+        '''Closes every connection and stops the server thread.'''
+        async def close():
+            self._server.close()
+            for writer in list(self._connections.values()):
+                writer.transport.abort()
+            await asyncio.gather(*list(self._connections.keys()), return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result(timeout)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+
+    def save_authentication(self, authentication_token, channels_permissions, is_private=False, time_to_live=SESSION_TIME_TO_LIVE):
+        '''Saves the channels and permissions ('r', 'w' and 'p' letters) of a token, as the authenticate endpoint does.'''
+        self._tokens[authentication_token] = (dict(channels_permissions), is_private, time.monotonic() + time_to_live)
+
+    def drop_connections(self):
+        '''Closes every websocket connection abruptly, without a close frame.'''
+        def drop():
+            for session in list(self._sessions):
+                session.writer.transport.abort()
+        self._loop.call_soon_threadsafe(drop)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request == None:
+                    break
+                method, path, headers, body = request
+                if headers.get('upgrade', '').lower() == 'websocket':
+                    await self._websocket(reader, writer, headers)
+                    break
+                status, content = self._route(method, path, body)
+                close = headers.get('connection', '').lower() == 'close'
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: text/plain\r\nContent-Length: %d\r\n%s\r\n' % (status, 'OK' if status < 300 else 'Error',
+                              len(content), 'Connection: close\r\n' if close else '')).encode() + content)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path = line.decode('latin-1').split(' ')[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            k, v = line.decode('latin-1').split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+        length = int(headers.get('content-length', 0))
+        body = (await reader.readexactly(length)).decode() if length else ''
+        return method, path, headers, body
+
+    def _route(self, method, path, body):
+        uri = urlparse(path)
+        parts = [unquote(p) for p in uri.path.strip('/').split('/')]
+        query = parse_qs(uri.query)
+        form = dict((k, v[0]) for k, v in parse_qs(body, keep_blank_values=True).items())
+        if method == 'GET' and len(parts) == 4 and parts[0] == 'presence':
+            return self._get_presence(parts[1], parts[2], parts[3])
+        if method == 'POST' and len(parts) == 4 and parts[0] == 'presence' and parts[1] in ('enable', 'disable'):
+            return self._set_presence(parts[1] == 'enable', parts[2], parts[3], form)
+        if method == 'POST' and parts == ['authenticate']:
+            return self._authenticate(form)
+        if method == 'GET' and 'appkey' in query:
+            return 200, ('var SOCKET_SERVER = "%s";' % self.url).encode()
+        return 404, b'Not found'
+
+    def _get_presence(self, application_key, authentication_token, channel):
+        if not self._valid_application_key(application_key):
+            return 401, b'Invalid application key'
+        if not self._permitted(self._token_permissions(authentication_token), channel, 'p'):
+            return 401, b'No permission to get presence'
+        if not channel in self._presence:
+            return 400, b'Presence is not enabled for the channel'
+        subscribers = self._subscribers.get(channel, ())
+        metadata = None
+        if self._presence[channel]:
+            metadata = {}
+            for session in subscribers:
+                if session.metadata:
+                    metadata[session.metadata] = metadata.get(session.metadata, 0) + 1
+        return 200, json.dumps({'subscriptions': len(subscribers), 'metadata': metadata}).encode()
+
+    def _set_presence(self, enable, application_key, channel, form):
+        if not self._valid_application_key(application_key) or not self._valid_private_key(form.get('privatekey')):
+            return 401, b'Invalid application or private key'
+        if enable:
+            self._presence[channel] = form.get('metadata') == '1'
+        else:
+            self._presence.pop(channel, None)
+        return 200, json.dumps({'content': 'Presence ' + ('enabled' if enable else 'disabled') + ' for the channel ' + channel}).encode()
+
+    def _authenticate(self, form):
+        if not self._valid_application_key(form.get('AK')) or not self._valid_private_key(form.get('PK')):
+            return 401, b'Invalid application or private key'
+        permissions = dict((k, v) for k, v in form.items() if not k in ('AT', 'AK', 'PK', 'TTL', 'PVT', 'TP'))
+        if not str(len(permissions)) == form.get('TP'):
+            return 400, b'Invalid number of permissions'
+        self.save_authentication(form.get('AT'), permissions, form.get('PVT') == '1', int(form.get('TTL', SESSION_TIME_TO_LIVE)))
+        return 201, b''
+
+    def _valid_application_key(self, application_key):
+        return self.application_key == None or application_key == self.application_key
+
+    def _valid_private_key(self, private_key):
+        return self.private_key == None or private_key == self.private_key
+
+    def _token_permissions(self, authentication_token):
+        # None allows every channel
+        entry = self._tokens.get(authentication_token)
+        if entry == None or entry[2] < time.monotonic():
+            return {} if self.authentication_required else None
+        return entry[0]
+
+    @staticmethod
+    def _permitted(permissions, channel, permission):
+        if permissions == None:
+            return True
+        p = permissions.get(channel)
+        if p == None:
+            i = channel.find(':')
+            if i >= 0:
+                p = permissions.get(channel[:i] + ':*')
+        return not p == None and permission in p
+
+    @staticmethod
+    def _hash(authentication_token, channel):
+        return hashlib.sha1((authentication_token + ':' + channel).encode()).hexdigest()[:16]
+
+    async def _websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers.get('sec-websocket-key', '') + WEBSOCKET_GUID).encode()).digest()).decode()
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + '\r\n\r\n').encode())
+        session = _Session(writer)
+        self._sessions.add(session)
+        self._send(session, 'o')
+        heartbeat = self._loop.create_task(self._heartbeat(session))
+        try:
+            while True:
+                message = await self._read_message(reader, session)
+                if message == None:
+                    break
+                self._received(session, message)
+                await writer.drain()
+        finally:
+            heartbeat.cancel()
+            self._sessions.discard(session)
+            for channel in session.channels:
+                self._remove_subscriber(session, channel)
+
+    async def _heartbeat(self, session):
+        while True:
+            interval = self.heartbeat_interval
+            await asyncio.sleep(interval if interval else 1)
+            if self.heartbeat_interval:
+                self._send(session, 'h')
+
+    async def _read_message(self, reader, session):
+        # returns the text of the next data message, answering control frames, or None when closed
+        fragments = []
+        while True:
+            head = await reader.readexactly(2)
+            opcode = head[0] & 0x0f
+            length = head[1] & 0x7f
+            if length == 126:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await reader.readexactly(8))[0]
+            if length > MAX_FRAME_SIZE:
+                return None
+            mask = await reader.readexactly(4) if head[1] & 0x80 else None
+            payload = await reader.readexactly(length)
+            if not mask == None and length:
+                key = int.from_bytes((mask * (length // 4 + 1))[:length], 'little')
+                payload = (int.from_bytes(payload, 'little') ^ key).to_bytes(length, 'little')
+            if opcode == 0x8:
+                session.writer.write(self._frame(0x8, payload[:2]))
+                return None
+            if opcode == 0x9:
+                session.writer.write(self._frame(0xa, payload))
+                continue
+            if opcode == 0xa:
+                continue
+            fragments.append(payload)
+            if head[0] & 0x80:
+                self.frames_received += 1
+                return b''.join(fragments).decode('utf-8')
+
+    @staticmethod
+    def _frame(opcode, data):
+        n = len(data)
+        if n < 126:
+            return struct.pack('!BB', 0x80 | opcode, n) + data
+        if n < 65536:
+            return struct.pack('!BBH', 0x80 | opcode, 126, n) + data
+        return struct.pack('!BBQ', 0x80 | opcode, 127, n) + data
+
+    def _send(self, session, text):
+        self.frames_sent += 1
+        session.writer.write(self._frame(0x1, text.encode()))
+
+    def _send_operation(self, session, operation, **params):
+        params['op'] = operation
+        self._send(session, 'a' + json.dumps([json.dumps(params, separators=(',', ':'))]))
+
+    def _received(self, session, message):
+        try:
+            commands = json.loads(message)
+        except ValueError:
+            return
+        for command in (commands if isinstance(commands, list) else [commands]):
+            if isinstance(command, str):
+                self._command(session, command.split(';', 5))
+
+    def _command(self, session, fields):
+        operation = fields[0]
+        if operation == 'validate':
+            self._validate(session, fields)
+        elif not session.validated:
+            self._send_operation(session, 'ortc-error', ex={'op': operation, 'ex': 'Connection not validated'})
+        elif operation == 'subscribe' and len(fields) > 3:
+            self._subscribe(session, fields[3])
+        elif operation == 'unsubscribe' and len(fields) > 2:
+            self._unsubscribe(session, fields[2])
+        elif operation == 'send' and len(fields) > 5:
+            self._relay(session, fields[3], fields[5])
+
+    def _validate(self, session, fields):
+        application_key, authentication_token = fields[1:3] if len(fields) > 2 else (None, None)
+        permissions = self._token_permissions(authentication_token)
+        if not self._valid_application_key(application_key) or permissions == {}:
+            self._send_operation(session, 'ortc-error', ex={'op': 'validate', 'ex': 'Unable to connect with the supplied application key and authentication token'})
+            return
+        session.validated = True
+        session.token = authentication_token
+        session.permissions = permissions
+        metadata = fields[5] if len(fields) > 5 else ''
+        session.metadata = metadata[:-1] if metadata.endswith(';') else metadata
+        up = None if permissions == None else dict((k, self._hash(authentication_token, k)) for k in permissions)
+        self._send_operation(session, 'ortc-validated', up=up, set=SESSION_TIME_TO_LIVE)
+
+    def _subscribe(self, session, channel):
+        if not self._permitted(session.permissions, channel, 'r'):
+            self._send_operation(session, 'ortc-error', ex={'op': 'subscribe', 'ch': channel, 'ex': 'Access denied to channel ' + channel})
+            return
+        session.channels.add(channel)
+        self._subscribers.setdefault(channel, set()).add(session)
+        self._send_operation(session, 'ortc-subscribed', ch=channel)
+
+    def _unsubscribe(self, session, channel):
+        if channel in session.channels:
+            session.channels.discard(channel)
+            self._remove_subscriber(session, channel)
+        self._send_operation(session, 'ortc-unsubscribed', ch=channel)
+
+    def _remove_subscriber(self, session, channel):
+        subscribers = self._subscribers.get(channel)
+        if not subscribers == None:
+            subscribers.discard(session)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def _relay(self, session, channel, message):
+        # message is "<message_id>_<part>-<total>_<payload>", relayed part by part as the cluster does
+        if not self._permitted(session.permissions, channel, 'w'):
+            self._send_operation(session, 'ortc-error', ex={'op': 'send', 'ch': channel, 'ex': 'Access denied to channel ' + channel})
+            return
+        self.messages_relayed += 1
+        subscribers = self._subscribers.get(channel)
+        if not subscribers:
+            return
+        frame = self._frame(0x1, ('a' + json.dumps([json.dumps({'ch': channel, 'm': message}, separators=(',', ':'))])).encode())
+        self.frames_sent += len(subscribers)
+        for subscriber in subscribers:
+            subscriber.writer.write(frame)
+
+
+if __name__ == '__main__':
+    server = OrtcServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 0)
+    server.start()
+    print('ORTC stand-in server on ' + server.url + ', cluster URL ' + server.cluster_url)
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop(5)
@@ -0,0 +1,44 @@
+"""Shared helpers of the tests running ortc.OrtcClient against a local ortc_server.OrtcServer."""
+
+import time
+import unittest
+from unittest import mock
+import ortc
+import ortc_server
+
+
+def wait_for(condition, timeout=5):
+    '''Polls *condition* until it holds, returns False if it still does not after *timeout* seconds.'''
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class OrtcServerTestCase(unittest.TestCase):
+    '''Starts an OrtcServer for each test, with heartbeats and reconnects within a fraction of a second.'''
+
+    def setUp(self):
+        for name, value in (('MAX_HEARTBEAT_INTERVAL', 1), ('RECONNECT_INTERVAL', 0.1)):
+            patcher = mock.patch.object(ortc, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # the stand-in server only speaks HTTP
+        patcher = mock.patch.object(ortc.http_pool, 'follow_scheme', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = ortc_server.OrtcServer(application_key='ak', private_key='pk', heartbeat_interval=0.2)
+        self.server.start()
+        self.addCleanup(self.server.stop, 5)
+
+    def connected_client(self, authentication_token='PM.Anonymous', metadata=''):
+        '''Returns an OrtcClient connected to the server, disconnected when the test ends.'''
+        client = ortc.OrtcClient()
+        client.cluster_url = self.server.cluster_url
+        client.connection_metadata = metadata
+        client.connect('ak', authentication_token)
+        self.assertTrue(wait_for(lambda: client.is_connected))
+        self.addCleanup(lambda: client.disconnect() if client.is_connected else None)
+        return client
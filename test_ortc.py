@@ -0,0 +1,90 @@
+"""Tests of ortc.OrtcClient."""
+
+import json
+import threading
+import time
+import unittest
+import ortc
+from ortc_testcase import OrtcServerTestCase, wait_for
+
+
+class OrtcClientTest(unittest.TestCase):
+
+    def test_replacing_the_dispatcher_closes_the_previous_one(self):
+        client = ortc.OrtcClient()
+        first = ortc.Dispatcher(ortc.dispatch_modes.POOL, workers=2)
+        client.dispatcher = first
+        client.dispatcher = ortc.Dispatcher()
+        self.assertTrue(first._closed)
+        client.dispatcher = client.dispatcher
+        self.assertFalse(client.dispatcher._closed)
+
+    def test_dispatches_every_element_of_a_batched_frame_in_order(self):
+        client = ortc.OrtcClient()
+        received = []
+        client._channels['blue'] = ortc.Channel('blue', True, lambda sender, channel, message: received.append(message))
+        client._parse_message('a' + json.dumps([json.dumps({'ch': 'blue', 'm': m}) for m in
+                                                ('one', 'id_2-2_ three', 'id_1-2_two', 'four')]))
+        self.assertEqual(received, ['one', 'two three', 'four'])
+
+
+class OrtcClientServerTest(OrtcServerTestCase):
+    # OrtcClient against a local ortc_server.OrtcServer
+
+    def test_subscribe_many_forgets_the_channels_that_time_out(self):
+        client = self.connected_client()
+        results = client.subscribe_many(['a', 'b'], True, lambda sender, channel, message: None, timeout=0).result(5)
+        self.assertEqual(sorted(results), ['a', 'b'])
+        self.assertTrue(all(results.values()))
+        self.assertFalse('a' in client._channels or 'b' in client._channels)
+        # the late acknowledgements are ignored, and the channels can be subscribed again
+        time.sleep(0.2)
+        self.assertFalse(client.is_subscribed('a'))
+        self.assertEqual(client.subscribe_many(['a'], True, lambda sender, channel, message: None, 5).result(5), {'a': None})
+        self.assertTrue(client.is_subscribed('a'))
+
+    def test_heartbeat_failure_reconnects_without_callbacks(self):
+        client = self.connected_client()
+        client._heartbeat_failed()
+        self.assertTrue(wait_for(lambda: client.is_connected, 10))
+
+    def test_reconnect_attempts_close_the_socket_they_replace(self):
+        client = self.connected_client()
+        ws = client._ws
+        # an earlier attempt opened the socket, but it was never validated
+        client._state = ortc.states.RECONNECTING
+        client.connect('ak')
+        self.assertFalse(client._ws is ws)
+        self.assertFalse(ws.connected)
+        self.assertTrue(wait_for(lambda: client.is_connected))
+
+    def test_heartbeat_failure_runs_the_callback_off_the_scheduler_thread(self):
+        client = self.connected_client()
+        threads = []
+        client.set_on_reconnecting_callback(lambda sender: threads.append(threading.current_thread()))
+        client._scheduler.call_later(0, client._heartbeat_failed)
+        self.assertTrue(wait_for(lambda: threads and client.is_connected, 10))
+        self.assertFalse(threads[0] is client._scheduler._thread)
+
+    def test_resubscribes_by_priority_off_the_scheduler_thread(self):
+        client = self.connected_client()
+        channels = ['ch%d' % i for i in range(50)]
+        client.subscribe_many(channels, True, lambda sender, channel, message: None).result(5)
+        client.subscribe('critical', True, lambda sender, channel, message: None, ortc.priorities.CRITICAL)
+        self.assertTrue(wait_for(lambda: client.is_subscribed('critical')))
+        written = []
+        write = client._write
+        def record(data):
+            written.append((threading.current_thread(), data))
+            write(data)
+        client._write = record
+        self.server.drop_connections()
+        self.assertTrue(wait_for(lambda: client.resubscribe_stats and client.resubscribe_stats['done'], 10))
+        self.assertTrue(all([client.is_subscribed(channel) for channel in channels + ['critical']]))
+        subscribes = [data for thread, data in written if 'subscribe;' in data]
+        self.assertTrue('critical' in subscribes[0])
+        self.assertFalse(any([thread is client._scheduler._thread for thread, data in written]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Tests of ortc_async.AsyncOrtcClient against a local ortc_server.OrtcServer."""
+
+import asyncio
+import json
+import unittest
+from unittest import mock
+import ortc
+import ortc_async
+import ortc_server
+from ortc_extensibility import OrtcError
+from ortc_testcase import wait_for
+
+
+class AsyncOrtcClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ortc_server.OrtcServer()
+        self.server.start()
+        self.addCleanup(self.server.stop, 5)
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 10))
+
+    async def connected_client(self):
+        client = ortc_async.AsyncOrtcClient()
+        client.cluster_url = self.server.cluster_url
+        await client.connect('ak')
+        return client
+
+    def test_subscribe_send_and_receive(self):
+        async def run():
+            client = await self.connected_client()
+            await client.subscribe('blue', True)
+            await client.send('blue', 'hello')
+            messages = client.messages('blue')
+            message = await messages.__anext__()
+            await client.disconnect()
+            return message
+        self.assertEqual(self.run_async(run()), 'hello')
+
+    def test_subscribe_timeout_forgets_the_channel(self):
+        async def run():
+            client = await self.connected_client()
+            with self.assertRaises(asyncio.TimeoutError):
+                await client.subscribe('blue', True, timeout=0)
+            self.assertFalse('blue' in client._channels)
+            self.assertFalse('blue' in client._acks)
+            # the late acknowledgement is ignored, and the channel can be subscribed again
+            await asyncio.sleep(0.2)
+            self.assertFalse(client.is_subscribed('blue'))
+            await client.subscribe('blue', True, timeout=5)
+            self.assertTrue(client.is_subscribed('blue'))
+            await client.disconnect()
+        self.run_async(run())
+
+    def test_failing_callbacks_are_reported_and_keep_the_client_receiving(self):
+        async def run():
+            client = await self.connected_client()
+            errors = []
+            received = []
+            client.set_on_exception_callback(lambda sender, error: errors.append(error))
+            client.set_on_subscribed_callback(lambda sender, channel: 1 / 0)
+            def on_message(sender, channel, message):
+                received.append(message)
+                raise ValueError('bad message')
+            async def on_message_async(sender, channel, message):
+                raise ValueError('bad coroutine')
+            await client.subscribe('blue', True, on_message)
+            await client.subscribe('red', True, on_message_async)
+            for message in ('one', 'two'):
+                await client.send('blue', message)
+            await client.send('red', 'three')
+            while len(errors) < 5:
+                await asyncio.sleep(0.01)
+            self.assertFalse(client._task.done())
+            self.assertEqual(received, ['one', 'two'])
+            await client.disconnect()
+            return errors
+        self.assertEqual(sorted(self.run_async(run())),
+                         ['bad coroutine', 'bad message', 'bad message', 'division by zero', 'division by zero'])
+
+    def test_reconnects_with_backoff_and_resubscribes(self):
+        delay = mock.Mock(wraps=ortc_async.Private._reconnect_delay)
+        async def run():
+            client = await self.connected_client()
+            await client.subscribe('blue', True)
+            messages = client.messages('blue')
+            with mock.patch.object(ortc_async, 'RECONNECT_INTERVAL', 0.05), mock.patch.object(ortc_async.Private, '_reconnect_delay', delay):
+                self.server.drop_connections()
+                while client.is_connected:
+                    await asyncio.sleep(0.01)
+                while not client.is_subscribed('blue'):
+                    await asyncio.sleep(0.01)
+            self.assertEqual(client._reconnect_attempts, 0)
+            await client.send('blue', 'after the reconnect')
+            message = await messages.__anext__()
+            await client.disconnect()
+            return message
+        self.assertEqual(self.run_async(run()), 'after the reconnect')
+        delay.assert_called_with(0, 0.05, ortc_async.MAX_RECONNECT_INTERVAL)
+
+    def threaded_sender(self):
+        sender = ortc.OrtcClient()
+        sender.cluster_url = self.server.cluster_url
+        sender.connect('ak')
+        self.assertTrue(wait_for(lambda: sender.is_connected))
+        self.addCleanup(sender.disconnect)
+        return sender
+
+    def test_receives_messages_compressed_by_the_threaded_client(self):
+        sender = self.threaded_sender()
+        sender.compression = True
+        document = json.dumps([{'symbol': 'S%d' % i, 'price': i * 1.5} for i in range(300)])
+        async def run():
+            client = await self.connected_client()
+            await client.subscribe('blue', True)
+            messages = client.messages('blue')
+            await asyncio.get_running_loop().run_in_executor(None, sender.send, 'blue', document)
+            await asyncio.get_running_loop().run_in_executor(None, sender.send, 'blue', 'small')
+            received = [await messages.__anext__(), await messages.__anext__()]
+            await client.disconnect()
+            return received
+        self.assertEqual(self.run_async(run()), [document, 'small'])
+
+    def test_exchanges_bytes_with_the_threaded_client(self):
+        sender = self.threaded_sender()
+        sender.compression = True
+        received = []
+        sender.subscribe('red', True, lambda client, channel, message: received.append(message))
+        sender.binary_messages = True
+        self.assertTrue(wait_for(lambda: sender.is_subscribed('red')))
+        data = bytes(range(256)) * 20
+        async def run():
+            client = await self.connected_client()
+            client.binary_messages = True
+            await client.subscribe('blue', True)
+            messages = client.messages('blue')
+            await asyncio.get_running_loop().run_in_executor(None, sender.send, 'blue', b'raw')
+            await asyncio.get_running_loop().run_in_executor(None, sender.send, 'blue', memoryview(data))
+            result = [await messages.__anext__(), await messages.__anext__()]
+            await client.send('red', bytearray(b'from async'))
+            await client.disconnect()
+            return result
+        self.assertEqual(self.run_async(run()), [b'raw', data])
+        self.assertTrue(wait_for(lambda: received))
+        self.assertEqual(received, [b'from async'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+"""Tests of the helpers in ortc_extensibility.py."""
+
+import contextlib
+import io
+import json
+import re
+import threading
+import unittest
+from ortc_extensibility import *
+
+
+def sockjs_frame(*elements):
+    # the server's compact JSON, escaped once more inside the a[...] array
+    return 'a' + json.dumps([json.dumps(element, separators=(',', ':')) for element in elements])
+
+
+class FrameDecoderTest(unittest.TestCase):
+
+    def test_decodes_every_element_of_a_batched_frame_in_order(self):
+        decoder = FrameDecoder()
+        frames = decoder.decode(sockjs_frame({'ch': 'blue', 'm': 'one'},
+                                             {'op': 'ortc-subscribed', 'ch': 'red'},
+                                             {'ch': 'blue', 'm': 'id_1-2_two'},
+                                             {'ch': 'red', 'm': 'id2_1-1_three'}))
+        self.assertEqual([type(frame) for frame in frames], [FrameMessage, FrameOperation, FrameFragment, FrameMessage])
+        self.assertEqual((frames[0].channel, frames[0].message, frames[0].message_id), ('blue', 'one', None))
+        self.assertEqual((frames[1].operation, frames[1].params), ('ortc-subscribed', {'ch': 'red'}))
+        self.assertEqual((frames[2].message_id, frames[2].part, frames[2].total_parts, frames[2].payload), ('id', 1, 2, 'two'))
+        self.assertEqual((frames[3].channel, frames[3].message, frames[3].message_id), ('red', 'three', 'id2'))
+        self.assertEqual((decoder.frames, decoder.elements, decoder.max_elements), (1, 4, 4))
+
+    def test_unescapes_like_the_regex_decoder(self):
+        message = 'say "hi" \\ back\nand \\"quoted\\" \\n'
+        frame = sockjs_frame({'ch': 'blue', 'm': message})
+        # the payload as the regex decoder extracted it, before Private._remove_slashes
+        raw = re.search(r'^a?\["\{\\"ch\\":\\"(.*)\\",\\"m\\":\\"([\s\S]*?)\\"\}"\]$', frame).groups()[1]
+        frames = FrameDecoder().decode(frame)
+        self.assertEqual(frames[0].message, Private._remove_slashes(raw))
+        self.assertEqual(frames[0].message, message)
+
+    def test_malformed_headers_are_plain_messages(self):
+        for message in ('id_x-y_payload', 'id_1-_payload', 'id_1-2', '_1-1_payload', 'no header'):
+            frames = FrameDecoder().decode(sockjs_frame({'ch': 'blue', 'm': message}))
+            self.assertEqual([type(frame) for frame in frames], [FrameMessage])
+            self.assertEqual((frames[0].message, frames[0].message_id), (message, None))
+
+    def test_decodes_operations(self):
+        frames = FrameDecoder().decode(sockjs_frame({'op': 'ortc-validated', 'up': None, 'set': 1800},
+                                                    {'op': 'ortc-validated', 'up': {'blue': 'r', 'red:*': 'w'}, 'set': 1800},
+                                                    {'op': 'ortc-error', 'ex': {'op': 'subscribe', 'ch': 'blue', 'ex': 'denied'}}))
+        self.assertEqual([(frame.operation, frame.params) for frame in frames],
+                         [('ortc-validated', {'up': None, 'set': 1800}),
+                          ('ortc-validated', {'up': {'blue': 'r', 'red:*': 'w'}, 'set': 1800}),
+                          ('ortc-error', {'ex': {'op': 'subscribe', 'ch': 'blue', 'ex': 'denied'}})])
+
+    def test_ignores_other_frames(self):
+        decoder = FrameDecoder()
+        for frame in ('o', 'h', 'c[3000,"Go away!"]', 'a[not json', 'a{"ch":"blue"}', sockjs_frame(['list'], {'ch': 'blue'})):
+            self.assertEqual(decoder.decode(frame), [])
+        self.assertEqual(decoder.frames, 1)
+
+
+class PrivateTest(unittest.TestCase):
+
+    def test_channel_error_checks_the_size_of_cached_channels(self):
+        self.assertEqual(Private._channel_error('cached:channel', 100), None)
+        self.assertEqual(Private._channel_error('cached:channel', 10), 'Channel size exceeds the limit of 10 characters')
+        self.assertEqual(Private._channel_error('bad channel', 100), 'Channel has invalid characters')
+        self.assertEqual(Private._channel_error('', 100), 'Channel is null or empty or not a string')
+        self.assertEqual(Private._channel_error(None, 100), 'Channel is null or empty or not a string')
+
+    def test_reconnect_delay_backs_off_with_jitter(self):
+        for attempts, low, high in ((0, 2.5, 5), (1, 5, 10), (3, 20, 40), (4, 30, 60), (100, 30, 60)):
+            delays = [Private._reconnect_delay(attempts, 5, 60) for i in range(50)]
+            self.assertTrue(all([low <= delay <= high for delay in delays]))
+            self.assertTrue(len(set(delays)) > 1)
+
+
+class MessageBufferTest(unittest.TestCase):
+
+    def test_reassembles_parts_in_any_order(self):
+        buffer = MessageBuffer(10, 1000, 60)
+        self.assertEqual(buffer.add_part('blue', 'id', 2, 2, 'world'), None)
+        self.assertEqual(buffer.add_part('blue', 'id', 1, 2, 'hello '), 'hello world')
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.bytes, 0)
+
+    def test_evicts_the_oldest_message_over_the_limits(self):
+        evicted = []
+        buffer = MessageBuffer(2, 1000, 60, lambda channel, message_id: evicted.append(message_id))
+        for message_id in ('a', 'b', 'c'):
+            buffer.add_part('blue', message_id, 1, 2, 'x')
+        self.assertEqual(evicted, ['a'])
+        self.assertEqual(buffer.evicted, 1)
+
+    def test_counts_a_message_replaced_by_a_different_number_of_parts(self):
+        evicted = []
+        buffer = MessageBuffer(10, 1000, 60, lambda channel, message_id: evicted.append((channel, message_id)))
+        buffer.add_part('blue', 'id', 1, 3, 'abc')
+        buffer.add_part('blue', 'id', 1, 2, 'de')
+        self.assertEqual(evicted, [('blue', 'id')])
+        self.assertEqual(buffer.evicted, 1)
+        self.assertEqual(buffer.bytes, 2)
+        self.assertEqual(buffer.add_part('blue', 'id', 2, 2, 'f'), 'def')
+
+
+class PresenceCacheTest(unittest.TestCase):
+
+    def test_shares_requests_and_caches_results(self):
+        from concurrent.futures import Future
+        cache = PresenceCache(60)
+        fetched = []
+        def fetch():
+            fetched.append(Future())
+            return fetched[-1]
+        first = cache.get('blue', fetch)
+        self.assertTrue(cache.get('blue', fetch) is first)
+        first.set_result({'subscriptions': 1})
+        self.assertEqual(cache.get('blue', fetch).result(0), {'subscriptions': 1})
+        self.assertEqual(len(fetched), 1)
+
+    def test_invalidating_a_channel_keeps_the_requests_of_the_others(self):
+        from concurrent.futures import Future
+        cache = PresenceCache(60)
+        fetched = []
+        def fetch():
+            fetched.append(Future())
+            return fetched[-1]
+        blue = cache.get('blue', fetch)
+        red = cache.get('red', fetch)
+        cache.invalidate('blue')
+        blue.set_result({'subscriptions': 1})
+        red.set_result({'subscriptions': 2})
+        self.assertEqual(cache.get('red', fetch).result(0), {'subscriptions': 2})
+        self.assertFalse(cache.get('blue', fetch) is blue)
+        self.assertEqual(len(fetched), 3)
+
+
+class SendQueueTest(unittest.TestCase):
+
+    def blocked_queue(self, max_size, overflow):
+        # the writer thread holds the first message until release is set
+        written = []
+        release = threading.Event()
+        def write(data):
+            release.wait(5)
+            written.append(data)
+        queue = SendQueue(write, max_size, overflow)
+        self.addCleanup(queue.close)
+        queue.put(['first'])
+        for i in range(100):
+            if not queue.depth:
+                break
+            release.wait(0.01)
+        return queue, written, release
+
+    def test_drop_oldest_drops_whole_messages(self):
+        queue, written, release = self.blocked_queue(4, overflow_policies.DROP_OLDEST)
+        queue.put(['a1', 'a2', 'a3'])
+        queue.put(['b1', 'b2'])
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.depth, 2)
+        release.set()
+        self.assertTrue(queue.drain(5))
+        self.assertEqual(written, ['first', FrameEncoder.batch(['b1', 'b2'])])
+
+    def test_raise_keeps_the_queued_messages(self):
+        queue, written, release = self.blocked_queue(2, overflow_policies.RAISE)
+        queue.put(['a1', 'a2'])
+        self.assertRaises(OrtcError, queue.put, ['b1'])
+        release.set()
+        self.assertTrue(queue.drain(5))
+        self.assertEqual(written, ['first', FrameEncoder.batch(['a1', 'a2'])])
+
+    def test_accepts_a_message_larger_than_the_queue(self):
+        queue, written, release = self.blocked_queue(2, overflow_policies.BLOCK)
+        release.set()
+        queue.put(['a1', 'a2', 'a3'])
+        self.assertTrue(queue.drain(5))
+        self.assertEqual(written[-1], FrameEncoder.batch(['a1', 'a2', 'a3']))
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def test_a_slow_channel_drops_its_oldest_messages_instead_of_blocking(self):
+        received = []
+        release = threading.Event()
+        def slow(message):
+            release.wait(5)
+            received.append(message)
+        dispatcher = Dispatcher(dispatch_modes.PER_CHANNEL, workers=2, max_queue=2)
+        self.addCleanup(dispatcher.close)
+        for i in range(5):
+            dispatcher.dispatch('blue', slow, i)
+        fast = threading.Event()
+        dispatcher.dispatch('red', fast.set)
+        self.assertTrue(fast.wait(5))
+        self.assertTrue(dispatcher.dropped >= 2)
+        release.set()
+        dispatcher.close()
+        dispatcher._executor.shutdown(wait=True)
+        self.assertEqual(received[-2:], [3, 4])
+
+    def test_close_dispatches_the_queued_messages_and_stops_the_workers(self):
+        received = []
+        release = threading.Event()
+        def callback(message):
+            release.wait(5)
+            received.append(message)
+        dispatcher = Dispatcher(dispatch_modes.PER_CHANNEL, workers=2)
+        for i in range(3):
+            dispatcher.dispatch('blue', callback, i)
+        dispatcher.close()
+        release.set()
+        dispatcher._executor.shutdown(wait=True)
+        self.assertEqual(received, [0, 1, 2])
+        dispatcher.dispatch('blue', callback, 3)
+        self.assertEqual(received, [0, 1, 2, 3])
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_runs_calls_in_deadline_order(self):
+        scheduler = Scheduler()
+        calls = []
+        done = threading.Event()
+        scheduler.call_later(0.02, calls.append, 'second')
+        scheduler.call_later(0.01, calls.append, 'first')
+        scheduler.call_later(0.03, done.set)
+        scheduler.call_later(0.015, calls.append, 'cancelled').cancel()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(calls, ['first', 'second'])
+
+    def test_passes_errors_to_the_call_on_error(self):
+        scheduler = Scheduler()
+        errors = []
+        done = threading.Event()
+        def fail():
+            raise ValueError('boom')
+        scheduler.call_later(0, fail, on_error=errors.append)
+        scheduler.call_later(0.01, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual([str(e) for e in errors], ['boom'])
+
+    def test_prints_errors_without_on_error_and_keeps_running(self):
+        scheduler = Scheduler()
+        done = threading.Event()
+        def fail():
+            raise ValueError('boom')
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            scheduler.call_later(0, fail)
+            scheduler.call_later(0.01, done.set)
+            self.assertTrue(done.wait(5))
+        self.assertTrue('ValueError: boom' in stderr.getvalue())
+
+
+class PayloadCodecTest(unittest.TestCase):
+
+    def round_trip(self, codec, message, binary=True):
+        prefix, text = codec.encode(message)
+        return prefix, codec.unwrap(prefix + 'id', text, binary)
+
+    def test_text_is_sent_as_is_unless_compressed(self):
+        self.assertEqual(self.round_trip(PayloadCodec(), 'hello'), ('', ('id', 'hello')))
+        message = 'hello world ' * 200
+        self.assertEqual(self.round_trip(PayloadCodec(True), message), (COMPRESSED_PREFIX, ('id', message)))
+
+    def test_bytes_round_trip(self):
+        import array
+        data = bytes(range(256))
+        self.assertEqual(self.round_trip(PayloadCodec(), data), (BINARY_PREFIX, ('id', data)))
+        self.assertEqual(self.round_trip(PayloadCodec(), bytearray(data)), (BINARY_PREFIX, ('id', data)))
+        numbers = array.array('i', range(100))
+        self.assertEqual(self.round_trip(PayloadCodec(), memoryview(numbers)), (BINARY_PREFIX, ('id', numbers.tobytes())))
+        self.assertEqual(self.round_trip(PayloadCodec(True), data * 20), (COMPRESSED_BINARY_PREFIX, ('id', data * 20)))
+
+    def test_binary_messages_stay_text_unless_requested(self):
+        codec = PayloadCodec()
+        prefix, text = codec.encode(b'raw')
+        self.assertEqual(codec.unwrap(prefix + 'id', text), ('id', text))
+
+    def test_invalid_payloads_raise_ortc_error(self):
+        codec = PayloadCodec()
+        self.assertRaises(OrtcError, codec.unwrap, BINARY_PREFIX + 'id', 'not base64!', True)
+        self.assertRaises(OrtcError, codec.unwrap, COMPRESSED_PREFIX + 'id', 'aGVsbG8=')
+
+    def test_decompression_stops_at_max_size(self):
+        codec = PayloadCodec(True, max_size=2000)
+        self.assertEqual(self.round_trip(codec, 'a' * 2000), (COMPRESSED_PREFIX, ('id', 'a' * 2000)))
+        prefix, text = codec.encode('a' * 2001)
+        with self.assertRaises(OrtcError) as raised:
+            codec.unwrap(prefix + 'id', text)
+        self.assertEqual(str(raised.exception), 'Decompressed message exceeds the limit of 2000 bytes')
+        # a few KB on the wire, which would inflate to gigabytes without the limit
+        bomb = PayloadCodec(True, level=9).compress(bytes(MAX_DECOMPRESSED_SIZE + 1))
+        self.assertTrue(len(bomb) < 50000)
+        self.assertRaises(OrtcError, PayloadCodec().unwrap, COMPRESSED_BINARY_PREFIX + 'id', bomb, True)
+
+
+if __name__ == '__main__':
+    unittest.main()
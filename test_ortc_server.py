@@ -0,0 +1,82 @@
+"""Regression tests of ortc.OrtcClient against ortc_server.OrtcServer, the local stand-in for an ORTC cluster."""
+
+import unittest
+import ortc
+from ortc_testcase import OrtcServerTestCase, wait_for
+
+
+class OrtcServerTest(OrtcServerTestCase):
+
+    def connected_client(self, authentication_token='PM.Anonymous', metadata=''):
+        client = OrtcServerTestCase.connected_client(self, authentication_token, metadata)
+        events = []
+        client.set_on_reconnecting_callback(lambda sender: events.append('reconnecting'))
+        client.set_on_reconnected_callback(lambda sender: events.append('reconnected'))
+        client.set_on_subscribed_callback(lambda sender, channel: events.append(('subscribed', channel)))
+        client.set_on_exception_callback(lambda sender, error: events.append(('exception', error)))
+        client.events = events
+        return client
+
+    def subscribe(self, client, channel, subscribe_on_reconnect=True):
+        received = []
+        client.subscribe(channel, subscribe_on_reconnect, lambda sender, ch, message: received.append(message))
+        self.assertTrue(wait_for(lambda: client.is_subscribed(channel)))
+        return received
+
+    def test_connect_subscribe_and_send(self):
+        sender = self.connected_client()
+        receiver = self.connected_client()
+        received = self.subscribe(receiver, 'blue')
+        long_message = ''.join([chr(ord('a') + i % 26) for i in range(3000)])
+        sender.send('blue', 'hello')
+        sender.send('blue', long_message)
+        self.assertTrue(wait_for(lambda: len(received) == 2))
+        self.assertEqual(received, ['hello', long_message])
+        receiver.unsubscribe('blue')
+        self.assertTrue(wait_for(lambda: not 'blue' in receiver._channels))
+
+    def test_drop_connections_reconnects_and_resubscribes(self):
+        client = self.connected_client()
+        received = self.subscribe(client, 'blue')
+        self.subscribe(client, 'yellow', False)
+        self.server.drop_connections()
+        self.assertTrue(wait_for(lambda: 'reconnected' in client.events and client.is_subscribed('blue'), 10))
+        self.assertTrue(client.events.index('reconnecting') < client.events.index('reconnected'))
+        self.assertFalse(client.is_subscribed('yellow'))
+        client.send('blue', 'after the reconnect')
+        self.assertTrue(wait_for(lambda: received == ['after the reconnect']))
+
+    def test_presence_endpoints(self):
+        client = self.connected_client(metadata='user1')
+        self.subscribe(client, 'blue')
+        client.enable_presence('pk', 'blue', True).result(5)
+        self.assertEqual(client.presence('blue').result(5), {'subscriptions': 1, 'metadata': {'user1': 1}})
+        client.disable_presence('pk', 'blue').result(5)
+        self.assertRaises(ortc.OrtcError, client.presence('blue').result, 5)
+        self.assertRaises(ortc.OrtcError, client.enable_presence('wrong key', 'blue', False).result, 5)
+
+    def test_authenticate_endpoint(self):
+        self.server.authentication_required = True
+        self.assertTrue(ortc.save_authentication(self.server.cluster_url, True, 'token', False, 'ak', 1800, 'pk', {'blue': 'rw', 'ro': 'r'}))
+        self.assertFalse(ortc.save_authentication(self.server.cluster_url, True, 'token', False, 'ak', 1800, 'wrong key', {'blue': 'r'}))
+        client = self.connected_client('token')
+        received = self.subscribe(client, 'blue')
+        client.send('blue', 'hello')
+        self.assertTrue(wait_for(lambda: received == ['hello']))
+        # the token can read but not write the channel, which the server rejects
+        client.send('ro', 'hello')
+        self.assertTrue(wait_for(lambda: ('exception', 'Access denied to channel ro') in client.events))
+
+    def test_unknown_token_is_rejected_when_authentication_is_required(self):
+        self.server.authentication_required = True
+        client = ortc.OrtcClient()
+        client.cluster_url = self.server.cluster_url
+        errors = []
+        client.set_on_exception_callback(lambda sender, error: errors.append(error))
+        client.connect('ak', 'unknown')
+        self.assertTrue(wait_for(lambda: errors))
+        self.assertFalse(client.is_connected)
+
+
+if __name__ == '__main__':
+    unittest.main()